@@ -1,4 +1,5 @@
 """Configuration settings for the IDS backend."""
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from typing import Optional
 
@@ -10,6 +11,7 @@ class Settings(BaseSettings):
     API_V1_PREFIX: str = "/api"
     PROJECT_NAME: str = "IDS System"
     VERSION: str = "1.0.0"
+    LOG_LEVEL: str = "INFO"  # DEBUG also logs every processed flow and broadcast
     
     # Network Interface
     # Common options: bridge0, bridge100, en0, enp0s1
@@ -17,6 +19,9 @@ class Settings(BaseSettings):
     # - en0: Primary network interface (macOS)
     # - enp0s1: Common Linux network interface
     INTERFACE_NAME: str = "bridge100"  # Default for macOS Multipass
+    SNIFFER_RAW_SOCKET: bool = True  # Linux: capture with a raw AF_PACKET socket instead of scapy
+    SNIFFER_QUEUE_SIZE: int = 8192  # captured packets waiting to be parsed before the oldest are dropped
+    SNIFFER_PROCESS: bool = False  # capture and track flows in a child process, off the API's GIL
     
     # Model Paths
     MODEL_DIR: str = "saved_models"
@@ -28,6 +33,21 @@ class Settings(BaseSettings):
     # Flow Manager Settings
     FLOW_IDLE_TIMEOUT: int = 60  # seconds
     FLOW_BATCH_SIZE: int = 10  # batch predictions
+    FLOW_FLUSH_MIN_PACKETS: int = 3  # flush active flows once they have this many packets
+    FLOW_FLUSH_MAX_AGE: int = 5  # ... or once they are this old (seconds)
+    
+    # Prediction API
+    PREDICT_BATCH_SIZE: int = 32  # max /predict-flow requests coalesced into one model call
+    PREDICT_BATCH_TIMEOUT_MS: float = 2  # how long a batch waits for more requests
+    PREDICT_CACHE_SIZE: int = 10000  # cached /predict-flow results for repeated identical flows
+    PREDICT_CACHE_TTL_SECONDS: float = 60
+    PREDICT_BATCH_MAX_FLOWS: int = 10000  # max flows per /predict-batch request
+    
+    # Prediction Store
+    PREDICTION_STORE_SIZE: int = Field(2000, ge=1)  # most recent events kept for /history and /stats
+    
+    # WebSocket
+    WEBSOCKET_QUEUE_SIZE: int = 256  # pending events per client before it is dropped as too slow
     
     # CORS
     CORS_ORIGINS: list[str] = [
@@ -1,124 +1,209 @@
 """Main FastAPI application."""
-from fastapi import FastAPI
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import asyncio
+import logging
+import logging.handlers
+import queue
+import weakref
 from datetime import datetime
-import json
+import numpy as np
+import orjson
 
 from app.config import settings
 from app.store import prediction_store
 from app.ml.predictor import predictor
-from app.services.flow_manager import FlowManager
+from app.services.flow_manager import FlowManager, build_flow_feature_matrix
 from app.services.packet_sniffer import PacketSniffer
-from app.routers import predictions, models, health, stats
-from app.routers.health import router as health_router
+from app.services.sniffer_process import ProcessPacketSniffer
+from app.services.batch_scheduler import batch_scheduler
+from app.routers import predictions, models, stats
+from app.routers.health import router as health_router, list_interfaces
 
-# WebSocket manager
-websocket_connections = set()
+logger = logging.getLogger(__name__)
+
+# WebSocket manager: each client gets a bounded outbound queue drained by its own writer task
+# (weak so dropped sockets are evicted even if cleanup is missed)
+client_queues: "weakref.WeakKeyDictionary[WebSocket, asyncio.Queue]" = weakref.WeakKeyDictionary()
+
+# Severity buckets for attacks by binary confidence: (.., 0.7] low, (0.7, 0.9] medium, (0.9, ..] high
+_SEVERITY_THRESHOLDS = [0.7, 0.9]
+_SEVERITY_LEVELS = np.array(["low", "medium", "high"], dtype=object)
+
+
+def start_logging() -> logging.handlers.QueueListener:
+    """
+    Route app logs through a queue so formatting and stream IO happen on a
+    background thread instead of the event loop.
+    """
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.LOG_LEVEL)
+    app_logger.propagate = False
+    app_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    
+    listener.start()
+    return listener
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events."""
     # Startup
-    print("=" * 50)
-    print("Starting IDS System...")
-    print("=" * 50)
+    log_listener = start_logging()
+    logger.info("=" * 50)
+    logger.info("Starting IDS System...")
+    logger.info("=" * 50)
     
     # Load ML models
     try:
         predictor.load_models()
-        print("✓ Models loaded successfully")
+        logger.info("✓ Models loaded successfully")
     except Exception as e:
-        print(f"✗ Error loading models: {e}")
+        logger.error(f"✗ Error loading models: {e}")
         raise
     
+    # Coalesce concurrent /predict-flow requests into batched model calls
+    batch_scheduler.start()
+    
     # Initialize flow manager
-    flow_manager = FlowManager(idle_timeout=settings.FLOW_IDLE_TIMEOUT)
+    # The packet thread wakes the flow processor when flows are ready to flush
+    loop = asyncio.get_running_loop()
+    flow_wakeup = asyncio.Event()
+    flow_manager = FlowManager(
+        idle_timeout=settings.FLOW_IDLE_TIMEOUT,
+        ready_min_packets=settings.FLOW_FLUSH_MIN_PACKETS,
+        on_flow_ready=lambda: loop.call_soon_threadsafe(flow_wakeup.set),
+    )
     flow_manager.start()
-    print("✓ Flow manager started")
+    logger.info("✓ Flow manager started")
     
     # Initialize packet sniffer (but don't start automatically)
+    # The sniffer runs in its own thread (or process), so completed flows are handed back to this loop;
+    # hand-offs still in progress are awaited at shutdown so the last flows aren't lost
+    pending_handoffs = set()
+    
+    def hand_off_flows(flows, features=None):
+        future = asyncio.run_coroutine_threadsafe(handle_completed_flows(flows, features), loop)
+        pending_handoffs.add(future)
+        future.add_done_callback(pending_handoffs.discard)
+    
     sniffer = None
     try:
-        sniffer = PacketSniffer(
-            interface=settings.INTERFACE_NAME,
-            flow_manager=flow_manager,
-            on_flow_complete=lambda flow: handle_completed_flow(flow),
-        )
+        if settings.SNIFFER_PROCESS:
+            # Tracks flows itself and only sends back completed ones, already featurized
+            sniffer = ProcessPacketSniffer(
+                interface=settings.INTERFACE_NAME,
+                on_flows=hand_off_flows,
+                raw_socket=settings.SNIFFER_RAW_SOCKET,
+                queue_size=settings.SNIFFER_QUEUE_SIZE,
+            )
+        else:
+            sniffer = PacketSniffer(
+                interface=settings.INTERFACE_NAME,
+                flow_manager=flow_manager,
+                on_flow_complete=lambda flow: hand_off_flows([flow]),
+                raw_socket=settings.SNIFFER_RAW_SOCKET,
+                queue_size=settings.SNIFFER_QUEUE_SIZE,
+            )
         # Don't start automatically - user can start via API
-        print(f"✓ Packet sniffer initialized (not started - use /api/health/sniffer/start to begin)")
+        logger.info("✓ Packet sniffer initialized (not started - use /api/health/sniffer/start to begin)")
     except Exception as e:
-        print(f"⚠ Warning: Could not initialize packet sniffer: {e}")
-        print("  You can still use the API for manual predictions.")
+        logger.warning(f"⚠ Warning: Could not initialize packet sniffer: {e}")
+        logger.warning("  You can still use the API for manual predictions.")
     
     # Start background task to process expired and active flows
     async def process_flows():
         while True:
-            await asyncio.sleep(5)  # Check every 5 seconds
+            # Sleep until the flow manager signals work; while flows are pending,
+            # also wake every FLOW_FLUSH_MAX_AGE seconds to flush old ones
+            timeout = settings.FLOW_FLUSH_MAX_AGE if flow_manager.get_active_flow_count() else None
+            try:
+                await asyncio.wait_for(flow_wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            flow_wakeup.clear()
             
             # Process expired flows (idle > 60 seconds)
             expired_flows = flow_manager.expire_flows()
             if expired_flows:
-                print(f"  [Flow Processor] Processing {len(expired_flows)} expired flows")
-            for flow in expired_flows:
-                handle_completed_flow(flow)
+                logger.info(f"  [Flow Processor] Processing {len(expired_flows)} expired flows")
             
             # Also flush active flows that have enough packets or are old enough
-            # This ensures flows appear faster (every 5 seconds or after 3 packets)
-            flushed_flows = flow_manager.flush_active_flows(min_packets=3, max_age_seconds=5)
+            # This ensures flows appear as soon as they have 3 packets (or after 5 seconds)
+            flushed_flows = flow_manager.flush_active_flows(max_age_seconds=settings.FLOW_FLUSH_MAX_AGE)
             if flushed_flows:
-                print(f"  [Flow Processor] Flushing {len(flushed_flows)} active flows")
-            for flow in flushed_flows:
-                handle_completed_flow(flow)
+                logger.info(f"  [Flow Processor] Flushing {len(flushed_flows)} active flows")
+            
+            # Predict all completed flows in a single batch
+            await handle_completed_flows(expired_flows + flushed_flows)
     
     asyncio.create_task(process_flows())
     
     # Store references
     app.state.flow_manager = flow_manager
+    app.state.flow_wakeup = flow_wakeup
     app.state.sniffer = sniffer
-    health.sniffer = sniffer
-    health.flow_manager = flow_manager
+    list_interfaces()  # Warm the interface cache used by the health endpoints
     
-    print("=" * 50)
-    print("IDS System ready!")
-    print("=" * 50)
+    logger.info("=" * 50)
+    logger.info("IDS System ready!")
+    logger.info("=" * 50)
     
     yield
     
     # Shutdown
-    print("\nShutting down IDS System...")
+    logger.info("Shutting down IDS System...")
     if sniffer:
-        sniffer.stop()
+        # stop() joins the capture threads (or process); a sniffer process hands off its
+        # open flows while stopping, so wait for those to be predicted and stored too
+        await asyncio.to_thread(sniffer.stop)
+        await asyncio.gather(
+            *(asyncio.wrap_future(future) for future in tuple(pending_handoffs)),
+            return_exceptions=True,
+        )
     if flow_manager:
-        flow_manager.stop()
-    print("✓ Shutdown complete")
+        await asyncio.to_thread(flow_manager.stop)
+    await batch_scheduler.stop()
+    logger.info("✓ Shutdown complete")
+    log_listener.stop()
 
 
-def handle_completed_flow(flow):
-    """Handle a completed flow: predict and broadcast."""
-    try:
-        # Convert flow to feature dictionary
-        flow_dict = flow.to_feature_dict()
-        
-        # Make prediction
-        result = predictor.predict(flow_dict)
-        
-        # Determine severity
-        if result.is_attack:
-            if result.binary_confidence > 0.9:
-                severity = "high"
-            elif result.binary_confidence > 0.7:
-                severity = "medium"
-            else:
-                severity = "low"
-        else:
-            severity = "none"
-        
-        # Create event dictionary
-        event = {
-            "timestamp": datetime.utcnow().isoformat(),
+def build_events_and_serialize(flows, features=None):
+    """
+    Featurize, predict and build events for a batch of flows (blocking, CPU-bound).
+    
+    Args:
+        flows: Completed flows (anything with their src/dst ip/port and protocol)
+        features: Their feature matrix, if already built (by the sniffer process)
+    
+    Returns:
+        (events, messages): event dicts and their serialized JSON strings, in flow order
+    """
+    # Featurize straight into a matrix (one row per flow) and predict the whole batch at once
+    if features is None:
+        features = build_flow_feature_matrix(flows)
+    results = predictor.predict_matrix(features)
+    
+    # Determine severity for the whole batch (attack confidence > 0.7 medium, > 0.9 high)
+    confidences = np.fromiter((r.binary_confidence for r in results), dtype=float, count=len(results))
+    is_attack = np.fromiter((r.is_attack for r in results), dtype=bool, count=len(results))
+    severities = np.where(
+        is_attack,
+        _SEVERITY_LEVELS[np.digitize(confidences, _SEVERITY_THRESHOLDS, right=True)],
+        "none",
+    ).tolist()
+    
+    # Create event dictionaries
+    timestamp = datetime.utcnow().isoformat()
+    events = [
+        {
+            "timestamp": timestamp,
             "src_ip": flow.src_ip,
             "dst_ip": flow.dst_ip,
             "src_port": flow.src_port,
@@ -130,43 +215,83 @@ def handle_completed_flow(flow):
             "confidence": result.binary_confidence,
             "binary_confidence": result.binary_confidence,  # Also include for history endpoint
         }
-        
+        for flow, result, severity in zip(flows, results, severities)
+    ]
+    
+    # Serialize once per event; decoded so the frontend keeps receiving text frames
+    messages = [orjson.dumps(event).decode() for event in events]
+    
+    return events, messages
+
+
+async def handle_completed_flows(flows, features=None):
+    """Handle a batch of completed flows (and their features, if built): predict and broadcast."""
+    if not flows:
+        return
+    
+    try:
+        # Run inference and serialization in a worker thread so the event loop stays responsive
+        events, messages = await asyncio.to_thread(build_events_and_serialize, flows, features)
+    except Exception as e:
+        logger.exception(f"✗ Error predicting {len(flows)} completed flows: {e}")
+        return
+    
+    # Per-flow logs are debug-only; skip formatting entirely when disabled
+    log_flows = logger.isEnabledFor(logging.DEBUG)
+    for event in events:
         # Add to in-memory store
         prediction_store.add_event(event)
         
         # Log successful processing
-        print(f"✓ Processed flow: {flow.src_ip}:{flow.src_port} -> {flow.dst_ip}:{flow.dst_port} ({flow.protocol}) - {result.attack_type} (confidence: {result.binary_confidence:.2f})")
-        
-        # Broadcast to all connected WebSocket clients
-        asyncio.create_task(broadcast_websocket(event))
+        if log_flows:
+            logger.debug(f"✓ Processed flow: {event['src_ip']}:{event['src_port']} -> {event['dst_ip']}:{event['dst_port']} ({event['protocol']}) - {event['attack_type']} (confidence: {event['binary_confidence']:.2f})")
     
-    except Exception as e:
-        import traceback
-        print(f"✗ Error handling completed flow: {e}")
-        print(f"  Flow: {flow.src_ip}:{flow.src_port} -> {flow.dst_ip}:{flow.dst_port} ({flow.protocol})")
-        traceback.print_exc()
+    # Broadcast to all connected WebSocket clients
+    await broadcast_websocket(messages)
 
 
-async def broadcast_websocket(event: dict):
-    """Broadcast event to all WebSocket connections."""
-    if not websocket_connections:
+async def broadcast_websocket(messages: list[str]):
+    """Queue pre-serialized events for all WebSocket clients without waiting on any of them."""
+    if not client_queues or not messages:
         return  # No clients connected
     
-    message = json.dumps(event)
-    disconnected = set()
-    
-    for ws in websocket_connections:
+    # Slow-consumer policy: a client whose queue is full is disconnected
+    slow_clients = []
+    for ws, queue in tuple(client_queues.items()):
         try:
-            await ws.send_text(message)
-        except Exception as e:
-            print(f"  [WebSocket] Error sending to client: {e}")
-            disconnected.add(ws)
+            for message in messages:
+                queue.put_nowait(message)
+        except asyncio.QueueFull:
+            slow_clients.append(ws)
     
-    # Remove disconnected clients
-    websocket_connections.difference_update(disconnected)
+    for ws in slow_clients:
+        logger.warning("  [WebSocket] Client too slow (queue full), disconnecting")
+        client_queues.pop(ws, None)
+        asyncio.create_task(_close_websocket(ws))
     
-    if websocket_connections:
-        print(f"  [WebSocket] Broadcasted event to {len(websocket_connections)} client(s)")
+    if client_queues and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"  [WebSocket] Broadcasted {len(messages)} event(s) to {len(client_queues)} client(s)")
+
+
+async def _websocket_writer(ws: WebSocket, queue: asyncio.Queue):
+    """Drain one client's queue onto its socket, in order."""
+    try:
+        while True:
+            message = await queue.get()
+            await ws.send_text(message)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"  [WebSocket] Error sending to client: {e}")
+        client_queues.pop(ws, None)
+
+
+async def _close_websocket(ws: WebSocket):
+    """Close a client socket, ignoring errors if it is already gone."""
+    try:
+        await ws.close(code=1013)  # Try again later
+    except Exception:
+        pass
 
 
 # Create FastAPI app
@@ -193,13 +318,13 @@ app.include_router(stats.router, prefix=settings.API_V1_PREFIX)
 
 
 # WebSocket endpoint
-from fastapi import WebSocket, WebSocketDisconnect
-
 @app.websocket(f"{settings.API_V1_PREFIX}/live")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for live prediction events."""
     await websocket.accept()
-    websocket_connections.add(websocket)
+    queue = asyncio.Queue(maxsize=settings.WEBSOCKET_QUEUE_SIZE)
+    writer = asyncio.create_task(_websocket_writer(websocket, queue))
+    client_queues[websocket] = queue
     
     try:
         while True:
@@ -207,7 +332,10 @@ async def websocket_endpoint(websocket: WebSocket):
             data = await websocket.receive_text()
             # Echo back or handle client messages if needed
     except WebSocketDisconnect:
-        websocket_connections.discard(websocket)
+        pass
+    finally:
+        client_queues.pop(websocket, None)
+        writer.cancel()
 
 
 @app.get("/")
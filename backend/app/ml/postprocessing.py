@@ -0,0 +1,135 @@
+"""ML postprocessing module - fuses binary and multiclass outputs into final decisions."""
+import numpy as np
+from typing import Optional, Tuple
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# Multiclass probability needed to flag an attack the binary model missed
+MULTICLASS_ATTACK_THRESHOLD = 0.6
+
+
+def _finalize_numpy(
+    binary_proba: np.ndarray,
+    binary_attack: np.ndarray,
+    multiclass_proba: np.ndarray,
+    benign_idx: int,
+    is_attack: np.ndarray,
+    attack_idx: np.ndarray,
+    attack_probs: np.ndarray,
+    confidence: np.ndarray,
+):
+    """NumPy implementation of the finalize kernel (used when numba isn't installed)."""
+    n = len(multiclass_proba)
+
+    # Top multiclass prediction
+    top_idx = np.argmax(multiclass_proba, axis=1)
+    top_prob = multiclass_proba[np.arange(n), top_idx]
+
+    # Attack if SVM says attack OR multiclass says a non-BENIGN class with high confidence
+    multiclass_attack = top_prob >= MULTICLASS_ATTACK_THRESHOLD
+    if benign_idx >= 0:
+        multiclass_attack &= top_idx != benign_idx
+        attack_probs[:] = np.delete(multiclass_proba, benign_idx, axis=1)
+    else:
+        attack_probs[:] = multiclass_proba  # treat all classes as attacks
+    np.logical_or(binary_attack, multiclass_attack, out=is_attack)
+
+    # Normalize attack-only probabilities to sum to 1 (avoid divide-by-zero)
+    total_attack_prob = attack_probs.sum(axis=1, keepdims=True)
+    attack_probs /= np.where(total_attack_prob > 0, total_attack_prob, 1.0)
+
+    attack_idx[:] = np.argmax(attack_probs, axis=1)
+    confidence[:] = binary_proba.max(axis=1)
+
+
+if NUMBA_AVAILABLE:
+    @njit(fastmath=True, cache=True)
+    def _finalize_numba(
+        binary_proba, binary_attack, multiclass_proba, benign_idx,
+        is_attack, attack_idx, attack_probs, confidence,
+    ):
+        """Same as _finalize_numpy, as one fused loop over rows with no temporaries."""
+        n, n_classes = multiclass_proba.shape
+        for i in range(n):
+            # Top multiclass prediction and attack-only probability mass in one pass
+            top = 0
+            top_prob = multiclass_proba[i, 0]
+            total = 0.0
+            for j in range(n_classes):
+                p = multiclass_proba[i, j]
+                if p > top_prob:
+                    top = j
+                    top_prob = p
+                if j != benign_idx:
+                    total += p
+
+            multiclass_attack = top_prob >= MULTICLASS_ATTACK_THRESHOLD and top != benign_idx
+            is_attack[i] = binary_attack[i] or multiclass_attack
+
+            if total <= 0.0:
+                total = 1.0
+
+            # Normalized attack-only probabilities and their argmax
+            k = 0
+            best = 0
+            best_prob = -1.0
+            for j in range(n_classes):
+                if j == benign_idx:
+                    continue
+                q = multiclass_proba[i, j] / total
+                attack_probs[i, k] = q
+                if q > best_prob:
+                    best = k
+                    best_prob = q
+                k += 1
+            attack_idx[i] = best
+
+            confidence[i] = max(binary_proba[i, 0], binary_proba[i, 1])
+
+    _finalize = _finalize_numba
+else:
+    _finalize = _finalize_numpy
+
+
+def finalize_predictions(
+    binary_proba: np.ndarray,
+    binary_attack: np.ndarray,
+    multiclass_proba: np.ndarray,
+    benign_idx: Optional[int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fuse binary and multiclass outputs for a batch of flows.
+
+    Args:
+        binary_proba: (N, 2) [benign, attack] probabilities from the binary model
+        binary_attack: (N,) bool, binary model says attack
+        multiclass_proba: (N, n_classes) multiclass probabilities
+        benign_idx: Column of BENIGN in multiclass_proba, or None if absent
+
+    Returns:
+        (is_attack, confidence, attack_idx, attack_probs) where attack_probs holds the
+        attack-only probabilities (BENIGN column removed) normalized per row and
+        attack_idx is the argmax column of attack_probs
+    """
+    n, n_classes = multiclass_proba.shape
+    benign = -1 if benign_idx is None else benign_idx
+
+    is_attack = np.empty(n, dtype=np.bool_)
+    attack_idx = np.empty(n, dtype=np.int64)
+    attack_probs = np.empty((n, n_classes - (benign >= 0)), dtype=np.float64)
+    confidence = np.empty(n, dtype=np.float64)
+
+    _finalize(
+        np.ascontiguousarray(binary_proba, dtype=np.float64),
+        np.ascontiguousarray(binary_attack, dtype=np.bool_),
+        np.ascontiguousarray(multiclass_proba, dtype=np.float64),
+        benign,
+        is_attack, attack_idx, attack_probs, confidence,
+    )
+
+    return is_attack, confidence, attack_idx, attack_probs
@@ -1,12 +1,31 @@
-"""ML model loading and prediction logic."""
+"""
+ML model loading and prediction logic.
+
+Precision: inference runs in float32. Feature matrices (build_feature_matrix,
+build_flow_feature_matrix) and the fused scaler + PCA map are float32, halving the
+bytes moved per batch versus float64. Integer features above 2**24 (e.g. long flow
+durations in microseconds) round to ~7 significant digits, which is far below what
+the standardized PCA inputs can resolve; the random forest compares against float32
+thresholds internally anyway. Count features stay in the same float32 matrix because
+a single dense matmul consumes every column.
+"""
+import os
+import threading
 import joblib
 import numpy as np
-import math
-from typing import Dict, Optional, Tuple
+from scipy.special import expit
+from typing import Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 
 from app.config import settings
-from app.ml.preprocessing import build_feature_vector_from_flow_dict, FEATURE_COLUMNS
+from app.ml.preprocessing import fill_feature_matrix, FEATURE_COLUMNS
+from app.ml.postprocessing import finalize_predictions
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
 
 
 class PredictionResult:
@@ -36,6 +55,28 @@ class MLPredictor:
         self.scaler = None
         self.pca = None
         self.loaded = False
+        
+        # Optional ONNX Runtime session for the multiclass model
+        self._rf_sess = None
+        
+        # Reusable feature buffer; grown only when a batch exceeds its capacity.
+        # Guarded by a lock because predictions run from worker threads too.
+        self._buf = np.empty((settings.FLOW_BATCH_SIZE, len(FEATURE_COLUMNS)), dtype=np.float32)
+        self._buf_lock = threading.Lock()
+        
+        # Scaler + PCA folded into one affine transform (set by load_models)
+        self._W: Optional[np.ndarray] = None
+        self._b: Optional[np.ndarray] = None
+        
+        # Binary (pred, proba) strategy for the loaded model (set by load_models)
+        self._binary_proba_fn: Optional[Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]] = None
+        
+        # Multiclass label metadata (set by load_models)
+        self._classes: Optional[np.ndarray] = None
+        self._class_names_list: List[str] = []
+        self._class_idx: Dict[str, int] = {}
+        self._benign_idx: Optional[int] = None
+        self._attack_labels: List[str] = []
     
     def load_models(self):
         """Load all ML models and preprocessors."""
@@ -69,9 +110,97 @@ class MLPredictor:
             raise FileNotFoundError(f"Multiclass model not found at {multiclass_path}")
         self.multiclass_model = joblib.load(multiclass_path)
         
+        # Load ONNX export of the multiclass model if available (pkl stays as fallback)
+        self._rf_sess = None
+        onnx_path = model_dir / "multiclass_rf_model.onnx"
+        if ONNXRUNTIME_AVAILABLE and onnx_path.exists():
+            sess_options = ort.SessionOptions()
+            sess_options.intra_op_num_threads = os.cpu_count() or 1
+            self._rf_sess = ort.InferenceSession(
+                str(onnx_path), sess_options, providers=["CPUExecutionProvider"]
+            )
+        
+        self._build_affine_transform()
+        
+        # Resolve how to get binary probabilities once, instead of per prediction
+        if hasattr(self.binary_model, "decision_function"):
+            self._binary_proba_fn = self._proba_decision_function
+        elif hasattr(self.binary_model, "predict_proba"):
+            self._binary_proba_fn = self._proba_predict_proba
+        else:
+            self._binary_proba_fn = self._proba_hard
+        
+        # Cache label metadata so predictions don't scan class names per call
+        self._classes = self.multiclass_model.classes_
+        self._class_names_list = [str(c) for c in self._classes]
+        self._class_idx = {name: i for i, name in enumerate(self._class_names_list)}
+        self._benign_idx = self._class_idx.get("BENIGN")
+        self._attack_labels = [
+            name for i, name in enumerate(self._class_names_list) if i != self._benign_idx
+        ]
+        
+        # Warm up the finalize kernel so the first live batch doesn't pay for JIT compilation
+        finalize_predictions(
+            np.zeros((1, 2)), np.zeros(1, dtype=bool),
+            np.zeros((1, len(self._classes))), self._benign_idx,
+        )
+        
         self.loaded = True
         print(f"✓ Loaded models: binary={type(self.binary_model).__name__}, "
-              f"multiclass={type(self.multiclass_model).__name__}")
+              f"multiclass={type(self.multiclass_model).__name__}"
+              f"{' (onnxruntime)' if self._rf_sess is not None else ''}")
+    
+    def _build_affine_transform(self):
+        """
+        Fold StandardScaler + PCA into a single float32 affine map.
+        
+        pca.transform(scaler.transform(X)) == X @ W + b, so the two sklearn
+        calls (and their float64 temporaries) become one float32 matmul.
+        """
+        components = self.pca.components_
+        # mean_ is still fitted when with_mean=False; only subtract it if the scaler does
+        scale = self.scaler.scale_ if self.scaler.with_std else 1.0
+        mean = self.scaler.mean_ if self.scaler.with_mean else 0.0
+        
+        W = (components / scale).T
+        b = -(mean / scale + self.pca.mean_) @ components.T
+        if getattr(self.pca, "whiten", False):
+            std = np.sqrt(self.pca.explained_variance_)
+            W = W / std
+            b = b / std
+        
+        self._W = np.ascontiguousarray(W, dtype=np.float32)
+        self._b = b.astype(np.float32)
+    
+    def _proba_decision_function(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Binary labels and [benign, attack] probabilities from one decision_function call.
+        Skips predict() and the Platt-scaled predict_proba() entirely.
+        """
+        scores = self.binary_model.decision_function(X)
+        # For binary SVM, scores is usually shape (N,)
+
+        if np.ndim(scores) == 1:
+            score = scores.astype(float)
+        else:
+            # If shape (N,2), use difference
+            score = (scores[:, 1] - scores[:, 0]).astype(float)
+
+        binary_pred = self.binary_model.classes_[(score > 0).astype(np.int8)]
+
+        # Map score to [0,1] with logistic function
+        prob_attack = expit(score)
+        return binary_pred, np.stack([1.0 - prob_attack, prob_attack], axis=1)
+    
+    def _proba_predict_proba(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Binary labels and probabilities from a model with predict_proba."""
+        return self.binary_model.predict(X), self.binary_model.predict_proba(X)
+    
+    def _proba_hard(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Last-resort fallback: no probabilities at all, trust the hard prediction (100% confidence)."""
+        binary_pred = self.binary_model.predict(X)
+        prob_attack = (binary_pred == 1).astype(float)
+        return binary_pred, np.stack([1.0 - prob_attack, prob_attack], axis=1)
     
     def predict(self, flow: Dict) -> PredictionResult:
         """
@@ -83,122 +212,107 @@ class MLPredictor:
         Returns:
             PredictionResult with prediction details
         """
+        return self.predict_batch([flow])[0]
+    
+    def predict_batch(self, flows: List[Dict]) -> List[PredictionResult]:
+        """
+        Predict attack types for a batch of flow dictionaries in one pass.
+        
+        Args:
+            flows: List of dictionaries with flow statistics
+            
+        Returns:
+            List of PredictionResult, one per flow and in the same order
+        """
         if not self.loaded:
             raise RuntimeError("Models not loaded. Call load_models() first.")
         
-        # Build feature vector in exact order
-        feature_vector = build_feature_vector_from_flow_dict(flow)
+        if not flows:
+            return []
+        
+        with self._buf_lock:
+            if len(flows) > len(self._buf):
+                self._buf = np.empty((max(len(flows), 2 * len(self._buf)), len(FEATURE_COLUMNS)), dtype=np.float32)
+            
+            # Build feature matrix in exact order (a view into the reusable buffer)
+            feature_matrix = fill_feature_matrix(flows, self._buf)
+            
+            # Apply preprocessing pipeline (exactly as in training)
+            # 1-2. StandardScaler + PCA, fused into one affine transform
+            pca_features = feature_matrix @ self._W + self._b
+        
+        return self._predict_pca(pca_features)
+    
+    def predict_matrix(self, features: np.ndarray) -> List[PredictionResult]:
+        """
+        Predict attack types for a prebuilt feature matrix (e.g. from build_flow_feature_matrix).
+        
+        Args:
+            features: Finite array of shape (n_flows, n_features) in FEATURE_COLUMNS order
+            
+        Returns:
+            List of PredictionResult, one per row and in the same order
+        """
+        if not self.loaded:
+            raise RuntimeError("Models not loaded. Call load_models() first.")
         
-        # Apply preprocessing pipeline (exactly as in training)
-        # 1. StandardScaler
-        scaled_features = self.scaler.transform(feature_vector)
+        if len(features) == 0:
+            return []
         
-        # 2. PCA transformation
-        pca_features = self.pca.transform(scaled_features)
+        # 1-2. StandardScaler + PCA, fused into one affine transform
+        pca_features = np.asarray(features, dtype=np.float32) @ self._W + self._b
         
+        return self._predict_pca(pca_features)
+    
+    def _predict_pca(self, pca_features: np.ndarray) -> List[PredictionResult]:
+        """Run the classifiers and decision fusion on PCA-transformed features (steps 3-6)."""
         # 3. Binary classification (attack vs benign)
-        binary_pred = self.binary_model.predict(pca_features)[0]
-
-        # Try to get probabilities if the model supports them
-        if hasattr(self.binary_model, "predict_proba"):
-            binary_proba = self.binary_model.predict_proba(pca_features)[0]
-            binary_confidence = float(max(binary_proba))
-        else:
-            # Fallback: estimate confidence from decision_function if available,
-            # otherwise just trust the hard prediction (100% confidence).
-            if hasattr(self.binary_model, "decision_function"):
-                scores = self.binary_model.decision_function(pca_features)
-                # For binary SVM, scores is usually shape (1,)
-
-                if np.ndim(scores) == 1:
-                    score = float(scores[0])
-                else:
-                    # If shape (1,2), use difference
-                    score = float(scores[0, 1] - scores[0, 0])
-
-                # Map score to [0,1] with logistic function
-                prob_attack = 1.0 / (1.0 + math.exp(-score))
-                binary_proba = np.array([1.0 - prob_attack, prob_attack], dtype=float)
-                binary_confidence = prob_attack if binary_pred == 1 else 1.0 - prob_attack
-            else:
-                # Last-resort fallback: no probabilities at all
-                if binary_pred == 1:
-                    binary_proba = np.array([0.0, 1.0], dtype=float)
-                else:
-                    binary_proba = np.array([1.0, 0.0], dtype=float)
-                binary_confidence = 1.0
+        binary_pred, binary_proba = self._binary_proba_fn(pca_features)
 
         # Decide if binary model thinks this is attack
         binary_attack = (binary_pred == 1)
 
         # 4. Multiclass classification (run always)
-        multiclass_proba = self.multiclass_model.predict_proba(pca_features)[0]
-        class_names = self.multiclass_model.classes_
-
-        # Top multiclass prediction
-        top_idx = int(np.argmax(multiclass_proba))
-        top_label = str(class_names[top_idx])
-        top_prob = float(multiclass_proba[top_idx])
+        if self._rf_sess is not None:
+            multiclass_proba = self._rf_sess.run(
+                ["probabilities"], {"X": pca_features}
+            )[0].astype(np.float64)
+        else:
+            multiclass_proba = self.multiclass_model.predict_proba(pca_features)
 
-        # 5. Fuse decisions:
+        # 5. Fuse decisions (one fused pass over the batch):
         #    - Attack if SVM says attack
         #    - OR if multiclass says a non-BENIGN class with high confidence
-        multiclass_attack = (top_label != "BENIGN" and top_prob >= 0.6)
-        is_attack = bool(binary_attack or multiclass_attack)
+        #    Also yields attack-only probabilities (no BENIGN) normalized to sum to 1
+        #    and the best attack type per row.
+        is_attack, binary_confidence, best_idx, attack_probs = finalize_predictions(
+            binary_proba, binary_attack, multiclass_proba, self._benign_idx
+        )
 
         # 6. Build attack_type + class_probabilities
-        attack_type = "BENIGN"
-        class_probabilities = {}
-
-        if is_attack:
-            # We want attack-only probabilities (no BENIGN), normalized to sum to 1
-            attack_labels = []
-            attack_probs = []
-
-            # Find index of 'BENIGN' if present
-            benign_idx = None
-            try:
-                benign_idx = int(np.where(class_names == "BENIGN")[0][0])
-            except Exception:
-                pass  # if not found, treat all classes as attacks
-
-            # Collect attack-only labels & probs
-            for i, class_name in enumerate(class_names):
-                if benign_idx is not None and i == benign_idx:
-                    continue  # skip BENIGN
-                attack_labels.append(str(class_name))
-                attack_probs.append(float(multiclass_proba[i]))
-
-            # Safeguard: avoid divide-by-zero
-            total_attack_prob = sum(attack_probs) or 1.0
-
-            # Normalize so attack-only probabilities sum to 1
-            attack_probs = [p / total_attack_prob for p in attack_probs]
-
-            # Choose best attack type based on normalized probs
-            best_idx = max(range(len(attack_probs)), key=lambda i: attack_probs[i])
-            attack_type = attack_labels[best_idx]
-
-            # Final probability dict (only attack classes)
-            class_probabilities = {
-                label: prob for label, prob in zip(attack_labels, attack_probs)
-            }
-
-        else:
-            # For benign flows, we only care about benign vs attack from binary model
-            class_probabilities["BENIGN"] = float(binary_proba[0])
-            class_probabilities["ATTACK"] = float(binary_proba[1])
-            attack_type = "BENIGN"
+        results = []
+        for i in range(len(pca_features)):
+            if is_attack[i]:
+                attack_type = self._attack_labels[best_idx[i]]
 
+                # Final probability dict (only attack classes)
+                class_probabilities = dict(zip(self._attack_labels, attack_probs[i].tolist()))
+            else:
+                # For benign flows, we only care about benign vs attack from binary model
+                class_probabilities = {
+                    "BENIGN": float(binary_proba[i, 0]),
+                    "ATTACK": float(binary_proba[i, 1]),
+                }
+                attack_type = "BENIGN"
 
+            results.append(PredictionResult(
+                is_attack=bool(is_attack[i]),
+                attack_type=attack_type,
+                binary_confidence=float(binary_confidence[i]),
+                class_probabilities=class_probabilities,
+            ))
         
-        return PredictionResult(
-            is_attack=is_attack,
-            attack_type=attack_type,
-            binary_confidence=binary_confidence,
-            class_probabilities=class_probabilities,
-            raw_features=feature_vector,
-        )
+        return results
     
     def get_model_info(self) -> Dict:
         """Get information about loaded models."""
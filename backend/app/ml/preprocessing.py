@@ -1,4 +1,6 @@
 """ML preprocessing module - extracts features from network flows exactly as in training."""
+import operator
+import warnings
 import numpy as np
 from typing import Dict, List, Optional
 
@@ -79,41 +81,64 @@ FEATURE_COLUMNS = [
 ]
 
 
-def build_feature_vector_from_flow_dict(flow: Dict) -> np.ndarray:
+# Precomputed extractors so feature matrices are filled at C speed
+_GETTER = operator.itemgetter(*FEATURE_COLUMNS)
+_N = len(FEATURE_COLUMNS)
+_FEATURE_SET = frozenset(FEATURE_COLUMNS)
+
+
+def fill_feature_matrix(flows: List[Dict], out: np.ndarray) -> np.ndarray:
     """
-    Build feature vector from flow dictionary in the exact order used during training.
+    Write features for a batch of flow dictionaries into an existing buffer.
     
     Args:
-        flow: Dictionary containing flow statistics with keys matching FEATURE_COLUMNS
+        flows: List of dictionaries containing flow statistics with keys matching FEATURE_COLUMNS
+        out: float32 array with at least len(flows) rows and n_features columns
         
     Returns:
-        numpy array of shape (n_features,) with features in the correct order
-        
-    Raises:
-        ValueError: If required features are missing
+        View of the first len(flows) rows of out, features in the correct order
     """
-    feature_vector = []
-    missing_features = []
+    out = out[:len(flows)]
     
-    for col in FEATURE_COLUMNS:
-        if col not in flow:
-            missing_features.append(col)
-            # Use 0 as default for missing features (shouldn't happen in production)
-            feature_vector.append(0.0)
-        else:
-            value = flow[col]
-            # Handle None/NaN values
-            if value is None or (isinstance(value, float) and np.isnan(value)):
-                feature_vector.append(0.0)
-            else:
-                feature_vector.append(float(value))
+    for i, flow in enumerate(flows):
+        missing_features = _FEATURE_SET.difference(flow.keys())
+        if missing_features:
+            # Log warning but don't fail - use 0 as default (shouldn't happen in production)
+            warnings.warn(f"Missing features: {sorted(missing_features)}. Using defaults.")
+            # Fill the gaps in a merged copy; the caller's dict is left untouched
+            flow = {**dict.fromkeys(missing_features, 0.0), **flow}
+        out[i] = _GETTER(flow)
     
-    if missing_features:
-        # Log warning but don't fail - use defaults
-        import warnings
-        warnings.warn(f"Missing features: {missing_features}. Using defaults.")
+    # Handle None/NaN values (None becomes NaN on assignment)
+    np.nan_to_num(out, copy=False)
     
-    return np.array(feature_vector, dtype=np.float32).reshape(1, -1)
+    return out
+
+
+def build_feature_matrix(flows: List[Dict]) -> np.ndarray:
+    """
+    Build a feature matrix from a batch of flow dictionaries.
+    
+    Args:
+        flows: List of dictionaries containing flow statistics with keys matching FEATURE_COLUMNS
+        
+    Returns:
+        numpy array of shape (n_flows, n_features) with features in the correct order
+    """
+    return fill_feature_matrix(flows, np.empty((len(flows), _N), dtype=np.float32))
+
+
+def build_feature_vector_from_flow_dict(flow: Dict) -> np.ndarray:
+    """
+    Build feature vector from flow dictionary in the exact order used during training.
+    
+    Args:
+        flow: Dictionary containing flow statistics with keys matching FEATURE_COLUMNS
+        
+    Returns:
+        numpy array of shape (1, n_features) with features in the correct order
+    """
+    return build_feature_matrix([flow])
 
 
 def validate_flow_dict(flow: Dict) -> bool:
@@ -0,0 +1,17 @@
+"""Custom response classes."""
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson.
+    
+    Return it directly from a route with plain dicts/lists to skip jsonable_encoder
+    and response_model validation; the route's response_model still documents the shape.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
@@ -1,27 +1,42 @@
 """Health check and system status endpoints."""
-from fastapi import APIRouter, HTTPException, Query
-from app.services.packet_sniffer import PacketSniffer
-from app.services.flow_manager import FlowManager
+import asyncio
+import functools
+import socket
+from fastapi import APIRouter, HTTPException, Query, Request
 from app.config import settings
 
+try:
+    from scapy.all import get_if_list
+except ImportError:
+    get_if_list = None
+
 router = APIRouter(prefix="/health", tags=["health"])
 
-# Global references (set by main app)
-sniffer: PacketSniffer = None
-flow_manager: FlowManager = None
+
+@functools.lru_cache(maxsize=1)
+def list_interfaces() -> list[str]:
+    """
+    List available network interfaces (empty if they can't be enumerated).
+    Memoized: warmed at startup and cleared when the sniffer interface changes.
+    Callers must not mutate the returned list.
+    """
+    try:
+        if get_if_list is not None:
+            return get_if_list()
+        # scapy is optional on the raw socket path; ask the OS directly
+        return [name for _, name in socket.if_nameindex()]
+    except Exception:
+        return []
 
 
 @router.get("/")
-async def health_check():
+async def health_check(request: Request):
     """
     Health check endpoint.
     """
-    available_interfaces = []
-    try:
-        from scapy.all import get_if_list
-        available_interfaces = get_if_list()
-    except Exception:
-        pass
+    sniffer = request.app.state.sniffer
+    flow_manager = request.app.state.flow_manager
+    available_interfaces = list_interfaces()
     
     sniffer_stats = {}
     if sniffer:
@@ -34,15 +49,17 @@ async def health_check():
         "available_interfaces": available_interfaces,
         "interface_exists": settings.INTERFACE_NAME in available_interfaces if available_interfaces else None,
         "sniffer_stats": sniffer_stats,
-        "active_flows": flow_manager.get_active_flow_count() if flow_manager else 0,
+        # A sniffer process tracks its own flows and reports them in its stats
+        "active_flows": sniffer_stats.get("active_flows", flow_manager.get_active_flow_count() if flow_manager else 0),
     }
 
 
 @router.post("/sniffer/start")
-async def start_sniffer():
+async def start_sniffer(request: Request):
     """
     Start the packet sniffer.
     """
+    sniffer = request.app.state.sniffer
     if not sniffer:
         raise HTTPException(status_code=400, detail="Sniffer not initialized")
     
@@ -50,24 +67,18 @@ async def start_sniffer():
         return {"status": "already_running", "message": "Sniffer is already running"}
     
     try:
-        # Check if interface exists
-        try:
-            from scapy.all import get_if_list
-            available_interfaces = get_if_list()
-            if settings.INTERFACE_NAME not in available_interfaces:
-                return {
-                    "status": "warning",
-                    "message": f"Interface '{settings.INTERFACE_NAME}' not found. Available: {available_interfaces}",
-                    "sniffer_running": False
-                }
-        except Exception as e:
-            # If we can't check interfaces, continue anyway
-            pass
+        # Check if interface exists (if we can't list interfaces, continue anyway)
+        available_interfaces = list_interfaces()
+        if available_interfaces and settings.INTERFACE_NAME not in available_interfaces:
+            return {
+                "status": "warning",
+                "message": f"Interface '{settings.INTERFACE_NAME}' not found. Available: {available_interfaces}",
+                "sniffer_running": False
+            }
         
         sniffer.start()
         
         # Give it a moment to start, then check if it's actually running
-        import asyncio
         await asyncio.sleep(0.5)
         
         if sniffer._running:
@@ -83,10 +94,11 @@ async def start_sniffer():
 
 
 @router.post("/sniffer/stop")
-async def stop_sniffer():
+async def stop_sniffer(request: Request):
     """
     Stop the packet sniffer.
     """
+    sniffer = request.app.state.sniffer
     if not sniffer:
         raise HTTPException(status_code=400, detail="Sniffer not initialized")
     
@@ -94,39 +106,37 @@ async def stop_sniffer():
         return {"status": "already_stopped", "message": "Sniffer is already stopped"}
     
     try:
-        sniffer.stop()
+        # stop() joins the capture threads (or process) for up to a few seconds
+        await asyncio.to_thread(sniffer.stop)
         return {"status": "stopped", "message": "Sniffer stopped"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to stop sniffer: {str(e)}")
 
 
 @router.post("/sniffer/interface")
-async def set_interface(interface: str = Query(..., description="Network interface name")):
+async def set_interface(request: Request, interface: str = Query(..., description="Network interface name")):
     """
     Change the network interface for the sniffer.
     Expects interface as query parameter: POST /api/health/sniffer/interface?interface=enp0s1
     """
+    sniffer = request.app.state.sniffer
     if not sniffer:
         raise HTTPException(status_code=400, detail="Sniffer not initialized")
     
-    # Check if interface exists
-    try:
-        from scapy.all import get_if_list
-        available_interfaces = get_if_list()
-        if interface not in available_interfaces:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Interface '{interface}' not found. Available: {available_interfaces}"
-            )
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to check interfaces: {str(e)}")
+    # Check if interface exists (refresh the cached list, interfaces may have changed;
+    # if they can't be listed, continue anyway)
+    list_interfaces.cache_clear()
+    available_interfaces = list_interfaces()
+    if available_interfaces and interface not in available_interfaces:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Interface '{interface}' not found. Available: {available_interfaces}"
+        )
     
     # Stop sniffer if running
     was_running = sniffer._running
     if was_running:
-        sniffer.stop()
+        await asyncio.to_thread(sniffer.stop)
     
     # Update interface
     sniffer.interface = interface
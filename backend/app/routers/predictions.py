@@ -1,14 +1,106 @@
 """API routes for predictions."""
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import asyncio
+import hashlib
+import secrets
+import time
 
+import numpy as np
+
+from app.config import settings
+from app.responses import ORJSONResponse
 from app.store import prediction_store
 from app.schemas.prediction import FlowInput, PredictionResponse, PredictionHistoryItem
-from app.ml.predictor import predictor
+from app.ml.predictor import predictor, PredictionResult
+from app.services.batch_scheduler import batch_scheduler
 from datetime import datetime
 
 router = APIRouter(prefix="/predictions", tags=["predictions"])
 
+# Severity by index: 0 for benign flows, 1-3 for attacks by binary confidence
+_SEVERITY = ("none", "low", "medium", "high")
+
+# LRU cache of recent predictions keyed by a hash of the feature vector, so repeated
+# identical flows (e.g. scans) skip the model. Only touched from the event loop.
+_PRED_CACHE: "OrderedDict[bytes, Tuple[float, PredictionResult]]" = OrderedDict()
+
+
+# Distinguishes ETags of this process from those of earlier ones: event ids (and the store
+# version) start over at every startup, so the same version can name different history
+_ETAG_EPOCH = secrets.token_hex(4)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header (a list of tags, or *) matches etag, compared weakly."""
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque_tag:
+            return True
+    return False
+
+
+def _cache_key(features: np.ndarray) -> bytes:
+    """Hash a flow's feature vector."""
+    return hashlib.blake2b(features.tobytes(), digest_size=16).digest()
+
+
+def _cache_get(key: bytes) -> Optional[PredictionResult]:
+    """Return a cached prediction, dropping it if it has expired."""
+    entry = _PRED_CACHE.get(key)
+    if entry is None:
+        return None
+    cached_at, result = entry
+    if time.monotonic() - cached_at > settings.PREDICT_CACHE_TTL_SECONDS:
+        del _PRED_CACHE[key]
+        return None
+    _PRED_CACHE.move_to_end(key)
+    return result
+
+
+def _cache_put(key: bytes, result: PredictionResult):
+    """Cache a prediction, evicting the least recently used entry when full."""
+    _PRED_CACHE[key] = (time.monotonic(), result)
+    _PRED_CACHE.move_to_end(key)
+    if len(_PRED_CACHE) > settings.PREDICT_CACHE_SIZE:
+        _PRED_CACHE.popitem(last=False)
+
+
+def _record_prediction(flow_input: FlowInput, result: PredictionResult, timestamp: str) -> PredictionResponse:
+    """Add a flow's prediction event (stamped with an ISO timestamp) to the store and build its API response."""
+    # Determine severity (attack confidence > 0.7 medium, > 0.9 high)
+    confidence = result.binary_confidence
+    severity = _SEVERITY[bool(result.is_attack) * (1 + (confidence > 0.7) + (confidence > 0.9))]
+    
+    # Create event dictionary
+    event = {
+        "timestamp": timestamp,
+        "src_ip": flow_input.src_ip,
+        "dst_ip": flow_input.dst_ip,
+        "src_port": flow_input.src_port,
+        "dst_port": flow_input.dst_port,
+        "protocol": flow_input.protocol,
+        "is_attack": result.is_attack,
+        "attack_type": result.attack_type,
+        "binary_confidence": result.binary_confidence,
+        "severity": severity,
+    }
+    
+    # Add to in-memory store
+    prediction_store.add_event(event)
+    
+    return PredictionResponse(
+        is_attack=result.is_attack,
+        attack_type=result.attack_type,
+        binary_confidence=result.binary_confidence,
+        class_probabilities=result.class_probabilities,
+        severity=severity,
+    )
+
 
 @router.post("/predict-flow", response_model=PredictionResponse)
 async def predict_flow(flow_input: FlowInput):
@@ -16,74 +108,82 @@ async def predict_flow(flow_input: FlowInput):
     Predict attack type for a single flow.
     """
     try:
-        # Convert input to flow dictionary
-        flow_dict = flow_input.to_flow_dict()
+        # Convert input straight to the model feature vector
+        features = flow_input.to_feature_vector()
         
-        # Make prediction
-        result = predictor.predict(flow_dict)
+        # Make prediction (batched with any concurrent requests) unless this flow was seen recently
+        key = _cache_key(features)
+        result = _cache_get(key)
+        if result is None:
+            result = await batch_scheduler.submit(features)
+            _cache_put(key, result)
         
-        # Determine severity
-        if result.is_attack:
-            if result.binary_confidence > 0.9:
-                severity = "high"
-            elif result.binary_confidence > 0.7:
-                severity = "medium"
-            else:
-                severity = "low"
-        else:
-            severity = "none"
-        
-        # Create event dictionary
-        event = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "src_ip": flow_input.src_ip,
-            "dst_ip": flow_input.dst_ip,
-            "src_port": flow_input.src_port,
-            "dst_port": flow_input.dst_port,
-            "protocol": flow_input.protocol,
-            "is_attack": result.is_attack,
-            "attack_type": result.attack_type,
-            "binary_confidence": result.binary_confidence,
-            "severity": severity,
-        }
-        
-        # Add to in-memory store
-        prediction_store.add_event(event)
-        
-        return PredictionResponse(
-            is_attack=result.is_attack,
-            attack_type=result.attack_type,
-            binary_confidence=result.binary_confidence,
-            class_probabilities=result.class_probabilities,
-            severity=severity,
+        return _record_prediction(flow_input, result, datetime.utcnow().isoformat())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+
+@router.post("/predict-batch", response_model=List[PredictionResponse])
+async def predict_batch(flow_inputs: List[FlowInput]):
+    """
+    Predict attack types for many flows in one model pass (for ingest pipelines).
+    """
+    if len(flow_inputs) > settings.PREDICT_BATCH_MAX_FLOWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.PREDICT_BATCH_MAX_FLOWS} flows per request",
         )
+    
+    if not flow_inputs:
+        return []
+    
+    try:
+        # One feature matrix and one model call for the whole request
+        features = np.stack([flow_input.to_feature_vector() for flow_input in flow_inputs])
+        results = await asyncio.to_thread(predictor.predict_matrix, features)
+        
+        # One timestamp for the whole request, like a batch of completed flows
+        timestamp = datetime.utcnow().isoformat()
+        return [_record_prediction(flow_input, result, timestamp) for flow_input, result in zip(flow_inputs, results)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 
 @router.get("/history", response_model=List[PredictionHistoryItem])
-async def get_history(limit: int = 100):
+async def get_history(request: Request, limit: int = Query(100, ge=0), since_id: Optional[int] = Query(None, ge=0)):
     """
     Get prediction history from in-memory store.
+    
+    Item ids are stable and increase with each event, so pollers can pass the newest id
+    they have as since_id to fetch only newer events. The ETag changes whenever an event
+    is added; a matching If-None-Match gets an empty 304 response.
     """
-    events = prediction_store.get_recent(limit)
+    version = prediction_store.version
+    etag = f'W/"{_ETAG_EPOCH}-{version}-{limit}-{since_id}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
     
-    # Convert events to PredictionHistoryItem format
-    history_items = []
-    for idx, event in enumerate(events, start=1):
-        history_items.append(PredictionHistoryItem(
-            id=idx,  # Use index as ID since we don't have DB IDs
-            src_ip=event.get("src_ip", ""),
-            dst_ip=event.get("dst_ip", ""),
-            src_port=event.get("src_port", 0),
-            dst_port=event.get("dst_port", 0),
-            protocol=event.get("protocol", ""),
-            is_attack=event.get("is_attack", False),
-            attack_type=event.get("attack_type", "BENIGN"),
-            binary_confidence=event.get("binary_confidence", 0.0),
-            severity=event.get("severity", "none"),
-            created_at=event.get("timestamp", datetime.utcnow().isoformat()),
-        ))
+    events = prediction_store.get_recent(limit, since_id)
     
-    return history_items
-
+    # Convert events to PredictionHistoryItem-shaped dicts (serialized directly by orjson;
+    # the response_model above only documents the shape). No validation is needed: the
+    # store only holds events built by this app from model output (see add_event).
+    history_items = [
+        {
+            "id": version - idx,
+            "src_ip": event.get("src_ip", ""),
+            "dst_ip": event.get("dst_ip", ""),
+            "src_port": event.get("src_port", 0),
+            "dst_port": event.get("dst_port", 0),
+            "protocol": event.get("protocol", ""),
+            "is_attack": event.get("is_attack", False),
+            "attack_type": event.get("attack_type", "BENIGN"),
+            "binary_confidence": event.get("binary_confidence", 0.0),
+            "severity": event.get("severity", "none"),
+            "created_at": event.get("timestamp") or datetime.utcnow().isoformat(),
+        }
+        for idx, event in enumerate(events)
+    ]
+    
+    return ORJSONResponse(history_items, headers=headers)
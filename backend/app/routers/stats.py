@@ -1,20 +1,30 @@
 """API routes for statistics."""
-from fastapi import APIRouter
+from typing import Tuple
+
+import orjson
+from fastapi import APIRouter, Response
 from app.store import prediction_store
 
 router = APIRouter(prefix="/stats", tags=["stats"])
 
+# Serialized stats and the store version they were built at. Stats only change when an
+# event is added, so polls between events reuse the same body. Only touched from the event loop.
+_stats_body: Tuple[int, bytes] = (-1, b"")
+
 
 @router.get("/")
 async def get_stats():
     """
     Get statistics computed from in-memory event store.
     """
-    stats = prediction_store.get_stats()
-    # Add total count for frontend compatibility
-    stats["totalFlows"] = stats.get("total_flows", 0)
-    stats["totalAttacks"] = stats.get("total_attacks", 0)
-    stats["attackRatio"] = stats.get("attack_ratio", 0)
-    stats["mostFrequentAttack"] = stats.get("most_frequent_attack", "N/A")
-    return stats
-
+    global _stats_body
+    version = prediction_store.version
+    if _stats_body[0] != version:
+        stats = prediction_store.get_stats()
+        # Add total count for frontend compatibility
+        stats["totalFlows"] = stats.get("total_flows", 0)
+        stats["totalAttacks"] = stats.get("total_attacks", 0)
+        stats["attackRatio"] = stats.get("attack_ratio", 0)
+        stats["mostFrequentAttack"] = stats.get("most_frequent_attack", "N/A")
+        _stats_body = (version, orjson.dumps(stats))
+    return Response(content=_stats_body[1], media_type="application/json")
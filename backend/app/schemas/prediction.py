@@ -1,8 +1,95 @@
 """Pydantic schemas for API requests and responses."""
 from pydantic import BaseModel, Field
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from datetime import datetime
 
+import numpy as np
+
+from app.ml.preprocessing import FEATURE_COLUMNS
+
+
+# Schema field names -> feature column names (matching FEATURE_COLUMNS)
+# Note: destination_port in features should use dst_port if destination_port not provided
+_FIELD_MAPPING: Tuple[Tuple[str, str], ...] = (
+    ('destination_port', 'Destination Port'),
+    ('flow_duration', 'Flow Duration'),
+    ('total_fwd_packets', 'Total Fwd Packets'),
+    ('total_backward_packets', 'Total Backward Packets'),
+    ('total_length_of_fwd_packets', 'Total Length of Fwd Packets'),
+    ('total_length_of_bwd_packets', 'Total Length of Bwd Packets'),
+    ('fwd_packet_length_max', 'Fwd Packet Length Max'),
+    ('fwd_packet_length_min', 'Fwd Packet Length Min'),
+    ('fwd_packet_length_mean', 'Fwd Packet Length Mean'),
+    ('fwd_packet_length_std', 'Fwd Packet Length Std'),
+    ('bwd_packet_length_max', 'Bwd Packet Length Max'),
+    ('bwd_packet_length_min', 'Bwd Packet Length Min'),
+    ('bwd_packet_length_mean', 'Bwd Packet Length Mean'),
+    ('bwd_packet_length_std', 'Bwd Packet Length Std'),
+    ('flow_bytes_s', 'Flow Bytes/s'),
+    ('flow_packets_s', 'Flow Packets/s'),
+    ('flow_iat_mean', 'Flow IAT Mean'),
+    ('flow_iat_std', 'Flow IAT Std'),
+    ('flow_iat_max', 'Flow IAT Max'),
+    ('flow_iat_min', 'Flow IAT Min'),
+    ('fwd_iat_total', 'Fwd IAT Total'),
+    ('fwd_iat_mean', 'Fwd IAT Mean'),
+    ('fwd_iat_std', 'Fwd IAT Std'),
+    ('fwd_iat_max', 'Fwd IAT Max'),
+    ('fwd_iat_min', 'Fwd IAT Min'),
+    ('bwd_iat_total', 'Bwd IAT Total'),
+    ('bwd_iat_mean', 'Bwd IAT Mean'),
+    ('bwd_iat_std', 'Bwd IAT Std'),
+    ('bwd_iat_max', 'Bwd IAT Max'),
+    ('bwd_iat_min', 'Bwd IAT Min'),
+    ('fwd_psh_flags', 'Fwd PSH Flags'),
+    ('fwd_urg_flags', 'Fwd URG Flags'),
+    ('fwd_header_length', 'Fwd Header Length'),
+    ('bwd_header_length', 'Bwd Header Length'),
+    ('fwd_packets_s', 'Fwd Packets/s'),
+    ('bwd_packets_s', 'Bwd Packets/s'),
+    ('min_packet_length', 'Min Packet Length'),
+    ('max_packet_length', 'Max Packet Length'),
+    ('packet_length_mean', 'Packet Length Mean'),
+    ('packet_length_std', 'Packet Length Std'),
+    ('packet_length_variance', 'Packet Length Variance'),
+    ('fin_flag_count', 'FIN Flag Count'),
+    ('syn_flag_count', 'SYN Flag Count'),
+    ('rst_flag_count', 'RST Flag Count'),
+    ('psh_flag_count', 'PSH Flag Count'),
+    ('ack_flag_count', 'ACK Flag Count'),
+    ('urg_flag_count', 'URG Flag Count'),
+    ('cwe_flag_count', 'CWE Flag Count'),
+    ('ece_flag_count', 'ECE Flag Count'),
+    ('down_up_ratio', 'Down/Up Ratio'),
+    ('average_packet_size', 'Average Packet Size'),
+    ('avg_fwd_segment_size', 'Avg Fwd Segment Size'),
+    ('avg_bwd_segment_size', 'Avg Bwd Segment Size'),
+    ('fwd_header_length_1', 'Fwd Header Length.1'),
+    ('subflow_fwd_packets', 'Subflow Fwd Packets'),
+    ('subflow_fwd_bytes', 'Subflow Fwd Bytes'),
+    ('subflow_bwd_packets', 'Subflow Bwd Packets'),
+    ('subflow_bwd_bytes', 'Subflow Bwd Bytes'),
+    ('init_win_bytes_forward', 'Init_Win_bytes_forward'),
+    ('init_win_bytes_backward', 'Init_Win_bytes_backward'),
+    ('act_data_pkt_fwd', 'act_data_pkt_fwd'),
+    ('min_seg_size_forward', 'min_seg_size_forward'),
+    ('active_mean', 'Active Mean'),
+    ('active_std', 'Active Std'),
+    ('active_max', 'Active Max'),
+    ('active_min', 'Active Min'),
+    ('idle_mean', 'Idle Mean'),
+    ('idle_std', 'Idle Std'),
+    ('idle_max', 'Idle Max'),
+    ('idle_min', 'Idle Min'),
+)
+
+
+# Schema field names in FEATURE_COLUMNS order, for building feature vectors directly
+_FEATURE_FIELDS: Tuple[str, ...] = tuple(
+    {feature_name: schema_key for schema_key, feature_name in _FIELD_MAPPING}[col]
+    for col in FEATURE_COLUMNS
+)
+
 
 class FlowInput(BaseModel):
     """Input schema for flow prediction."""
@@ -87,92 +174,35 @@ class FlowInput(BaseModel):
     
     def to_flow_dict(self) -> Dict:
         """Convert to dictionary with proper column names matching FEATURE_COLUMNS."""
-        # Map schema field names to feature column names
-        # Note: destination_port in features should use dst_port if destination_port not provided
-        mapping = {
-            'destination_port': 'Destination Port',
-            'flow_duration': 'Flow Duration',
-            'total_fwd_packets': 'Total Fwd Packets',
-            'total_backward_packets': 'Total Backward Packets',
-            'total_length_of_fwd_packets': 'Total Length of Fwd Packets',
-            'total_length_of_bwd_packets': 'Total Length of Bwd Packets',
-            'fwd_packet_length_max': 'Fwd Packet Length Max',
-            'fwd_packet_length_min': 'Fwd Packet Length Min',
-            'fwd_packet_length_mean': 'Fwd Packet Length Mean',
-            'fwd_packet_length_std': 'Fwd Packet Length Std',
-            'bwd_packet_length_max': 'Bwd Packet Length Max',
-            'bwd_packet_length_min': 'Bwd Packet Length Min',
-            'bwd_packet_length_mean': 'Bwd Packet Length Mean',
-            'bwd_packet_length_std': 'Bwd Packet Length Std',
-            'flow_bytes_s': 'Flow Bytes/s',
-            'flow_packets_s': 'Flow Packets/s',
-            'flow_iat_mean': 'Flow IAT Mean',
-            'flow_iat_std': 'Flow IAT Std',
-            'flow_iat_max': 'Flow IAT Max',
-            'flow_iat_min': 'Flow IAT Min',
-            'fwd_iat_total': 'Fwd IAT Total',
-            'fwd_iat_mean': 'Fwd IAT Mean',
-            'fwd_iat_std': 'Fwd IAT Std',
-            'fwd_iat_max': 'Fwd IAT Max',
-            'fwd_iat_min': 'Fwd IAT Min',
-            'bwd_iat_total': 'Bwd IAT Total',
-            'bwd_iat_mean': 'Bwd IAT Mean',
-            'bwd_iat_std': 'Bwd IAT Std',
-            'bwd_iat_max': 'Bwd IAT Max',
-            'bwd_iat_min': 'Bwd IAT Min',
-            'fwd_psh_flags': 'Fwd PSH Flags',
-            'fwd_urg_flags': 'Fwd URG Flags',
-            'fwd_header_length': 'Fwd Header Length',
-            'bwd_header_length': 'Bwd Header Length',
-            'fwd_packets_s': 'Fwd Packets/s',
-            'bwd_packets_s': 'Bwd Packets/s',
-            'min_packet_length': 'Min Packet Length',
-            'max_packet_length': 'Max Packet Length',
-            'packet_length_mean': 'Packet Length Mean',
-            'packet_length_std': 'Packet Length Std',
-            'packet_length_variance': 'Packet Length Variance',
-            'fin_flag_count': 'FIN Flag Count',
-            'syn_flag_count': 'SYN Flag Count',
-            'rst_flag_count': 'RST Flag Count',
-            'psh_flag_count': 'PSH Flag Count',
-            'ack_flag_count': 'ACK Flag Count',
-            'urg_flag_count': 'URG Flag Count',
-            'cwe_flag_count': 'CWE Flag Count',
-            'ece_flag_count': 'ECE Flag Count',
-            'down_up_ratio': 'Down/Up Ratio',
-            'average_packet_size': 'Average Packet Size',
-            'avg_fwd_segment_size': 'Avg Fwd Segment Size',
-            'avg_bwd_segment_size': 'Avg Bwd Segment Size',
-            'fwd_header_length_1': 'Fwd Header Length.1',
-            'subflow_fwd_packets': 'Subflow Fwd Packets',
-            'subflow_fwd_bytes': 'Subflow Fwd Bytes',
-            'subflow_bwd_packets': 'Subflow Bwd Packets',
-            'subflow_bwd_bytes': 'Subflow Bwd Bytes',
-            'init_win_bytes_forward': 'Init_Win_bytes_forward',
-            'init_win_bytes_backward': 'Init_Win_bytes_backward',
-            'act_data_pkt_fwd': 'act_data_pkt_fwd',
-            'min_seg_size_forward': 'min_seg_size_forward',
-            'active_mean': 'Active Mean',
-            'active_std': 'Active Std',
-            'active_max': 'Active Max',
-            'active_min': 'Active Min',
-            'idle_mean': 'Idle Mean',
-            'idle_std': 'Idle Std',
-            'idle_max': 'Idle Max',
-            'idle_min': 'Idle Min',
+        fields = self.__dict__
+        flow_dict = {
+            feature_name: fields[schema_key]
+            for schema_key, feature_name in _FIELD_MAPPING
+            if fields[schema_key] is not None
         }
         
-        flow_dict = {}
-        for schema_key, feature_name in mapping.items():
-            value = getattr(self, schema_key, None)
-            if value is not None:
-                flow_dict[feature_name] = value
-        
         # Handle destination_port special case (use dst_port if destination_port not set)
         if 'Destination Port' not in flow_dict and self.dst_port is not None:
             flow_dict['Destination Port'] = self.dst_port
         
         return flow_dict
+    
+    def to_feature_vector(self) -> np.ndarray:
+        """
+        Build the model feature vector directly, without an intermediate dictionary.
+        
+        Returns:
+            float32 array of shape (n_features,) in FEATURE_COLUMNS order; features that
+            weren't provided (or are NaN) are 0, inf is clamped to the float32 range, and
+            Destination Port falls back to dst_port
+        """
+        fields = self.__dict__
+        if fields['destination_port'] is None:
+            fields = {**fields, 'destination_port': self.dst_port}
+        vec = np.array([fields[name] or 0.0 for name in _FEATURE_FIELDS], dtype=np.float32)
+        if not np.isfinite(vec).all():
+            np.nan_to_num(vec, copy=False)
+        return vec
 
 
 class PredictionResponse(BaseModel):
@@ -0,0 +1,123 @@
+"""Micro-batching scheduler that coalesces concurrent prediction requests."""
+import asyncio
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.ml.predictor import predictor, PredictionResult
+
+
+class BatchScheduler:
+    """
+    Queue single-flow prediction requests and run them through one predict_matrix call.
+
+    Requests arriving within batch_timeout_ms of each other (up to max_batch_size)
+    share one vectorized model call instead of paying the per-call overhead each.
+    """
+
+    def __init__(
+        self,
+        predict_matrix_fn: Callable[[np.ndarray], List[PredictionResult]],
+        max_batch_size: int = 32,
+        batch_timeout_ms: float = 2,
+    ):
+        self.predict_matrix_fn = predict_matrix_fn
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Requests taken off the queue for the batch being collected or predicted
+        self._in_flight: list = []
+
+    def start(self):
+        """Start the batching task on the running event loop."""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching task and fail any requests still waiting."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        pending = self._in_flight
+        self._in_flight = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    async def submit(self, features: np.ndarray) -> PredictionResult:
+        """
+        Queue a flow for prediction and wait for its result.
+
+        Args:
+            features: Feature vector of shape (n_features,) in FEATURE_COLUMNS order
+
+        Returns:
+            PredictionResult for this flow
+        """
+        if self._task is None:
+            # Not started (e.g. outside the app lifespan): predict directly
+            results = await asyncio.to_thread(self.predict_matrix_fn, features.reshape(1, -1))
+            return results[0]
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((features, future))
+        return await future
+
+    async def _collect_batch(self, batch: list):
+        """Wait for one request, then gather more into batch until it is full or the timeout passes."""
+        loop = asyncio.get_running_loop()
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.batch_timeout
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        """Main batching loop."""
+        while True:
+            # Kept on self so stop() can fail these requests if it cancels us mid-batch
+            batch = self._in_flight = []
+            await self._collect_batch(batch)
+            features = np.stack([vec for vec, _ in batch])
+
+            try:
+                results = await asyncio.to_thread(self.predict_matrix_fn, features)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Callers that gave up (e.g. disconnected) have cancelled futures
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+# Global scheduler instance for the prediction API
+batch_scheduler = BatchScheduler(
+    predictor.predict_matrix,
+    max_batch_size=settings.PREDICT_BATCH_SIZE,
+    batch_timeout_ms=settings.PREDICT_BATCH_TIMEOUT_MS,
+)
@@ -1,15 +1,77 @@
 """Flow manager for aggregating packets into flows."""
 from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import heapq
+import itertools
+import math
 import threading
 import time
 
+import numpy as np
+
+from app.ml.preprocessing import FEATURE_COLUMNS
+from app.services.flow_stats import RunningStats
+
+
+# TCP flag bits, as in the TCP header flags byte (PacketInfo.flags is this 8-bit mask)
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+TCP_URG = 0x20
+TCP_ECE = 0x40
+TCP_CWE = 0x80
+
+# Extra bit set on flag masks of forward packets when counting them
+_FWD = 0x100
+
+# Dead heap entries a shard tolerates before compacting, on top of one per live flow
+_COMPACT_MIN_ENTRIES = 64
+
+# Flag bits set in each mask, for expanding mask counts into per-flag counts
+_MASK_BITS = tuple(tuple(1 << i for i in range(8) if mask >> i & 1) for mask in range(256))
+
+
+class PacketInfo:
+    """
+    Header fields of one captured packet.
+    
+    Flow.add_packet copies the fields out right away, so a producer can refill and
+    pass the same instance for every packet instead of allocating one per packet.
+    """
+    
+    __slots__ = ("direction", "size", "header_size", "flags", "timestamp", "window_size")
+    
+    def __init__(
+        self,
+        direction: str = 'forward',
+        size: int = 0,
+        header_size: int = 0,
+        flags: int = 0,
+        timestamp: Optional[float] = None,
+        window_size: int = 0,
+    ):
+        self.direction = direction  # 'forward' or 'backward'
+        self.size = size
+        self.header_size = header_size
+        self.flags = flags  # TCP flags byte
+        self.timestamp = timestamp  # time.monotonic() seconds; None means now
+        self.window_size = window_size
+
 
 class Flow:
     """Represents a network flow (5-tuple)."""
     
-    def __init__(self, src_ip: str, dst_ip: str, src_port: int, dst_port: int, protocol: str):
+    def __init__(
+        self,
+        src_ip: str,
+        dst_ip: str,
+        src_port: int,
+        dst_port: int,
+        protocol: str,
+        timestamp: Optional[float] = None,
+    ):
         self.src_ip = src_ip
         self.dst_ip = dst_ip
         self.src_port = src_port
@@ -22,27 +84,24 @@ class Flow:
         self.total_fwd_bytes = 0
         self.total_bwd_bytes = 0
         
-        # Packet lengths
-        self.fwd_packet_lengths = []
-        self.bwd_packet_lengths = []
+        # Packet length statistics, updated online (no per-packet samples kept)
+        self.fwd_packet_lengths = RunningStats()
+        self.bwd_packet_lengths = RunningStats()
         
-        # Timestamps
-        self.first_seen = datetime.utcnow()
-        self.last_seen = datetime.utcnow()
-        self.fwd_timestamps = []
-        self.bwd_timestamps = []
+        # Timestamps (epoch seconds) and inter-arrival time statistics (microseconds)
+        # time.monotonic() seconds: immune to wall-clock jumps, only differences are meaningful.
+        # Taken from the first packet (captured before the flow is created) when given
+        self.first_seen = timestamp or time.monotonic()
+        self.last_seen = self.first_seen
+        self.fwd_last_seen: Optional[float] = None
+        self.bwd_last_seen: Optional[float] = None
+        self.fwd_iat = RunningStats()
+        self.bwd_iat = RunningStats()
         
-        # Flags
-        self.fwd_psh_flags = 0
-        self.fwd_urg_flags = 0
-        self.fin_flags = 0
-        self.syn_flags = 0
-        self.rst_flags = 0
-        self.psh_flags = 0
-        self.ack_flags = 0
-        self.urg_flags = 0
-        self.cwe_flags = 0
-        self.ece_flags = 0
+        # Flags: packet count per (flag mask | _FWD for forward packets). A flow sees only a
+        # handful of distinct masks, so this is one dict update per packet; per-flag
+        # counts are expanded from it in flag_counts()
+        self.flag_mask_counts: Dict[int, int] = {}
         
         # Header lengths
         self.fwd_header_length = 0
@@ -66,160 +125,228 @@ class Flow:
         self.active_times = []
         self.idle_times = []
     
-    def add_packet(self, packet_info: Dict):
+    def add_packet(self, packet_info: PacketInfo):
         """Add a packet to this flow."""
-        direction = packet_info.get('direction', 'forward')  # 'forward' or 'backward'
-        packet_size = packet_info.get('size', 0)
-        header_size = packet_info.get('header_size', 0)
-        flags = packet_info.get('flags', {})
-        timestamp = packet_info.get('timestamp', datetime.utcnow())
-        window_size = packet_info.get('window_size', 0)
+        direction = packet_info.direction
+        packet_size = packet_info.size
+        header_size = packet_info.header_size
+        flags = packet_info.flags
+        timestamp = packet_info.timestamp or time.monotonic()
+        window_size = packet_info.window_size
         
         if direction == 'forward':
             self.total_fwd_packets += 1
             self.total_fwd_bytes += packet_size
-            self.fwd_packet_lengths.append(packet_size)
-            self.fwd_timestamps.append(timestamp)
+            self.fwd_packet_lengths.add(packet_size)
+            if self.fwd_last_seen is not None:
+                self.fwd_iat.add((timestamp - self.fwd_last_seen) * 1000000)
+            self.fwd_last_seen = timestamp
             self.fwd_header_length += header_size
             if self.init_win_bytes_forward == 0:
                 self.init_win_bytes_forward = window_size
         else:
             self.total_backward_packets += 1
             self.total_bwd_bytes += packet_size
-            self.bwd_packet_lengths.append(packet_size)
-            self.bwd_timestamps.append(timestamp)
+            self.bwd_packet_lengths.add(packet_size)
+            if self.bwd_last_seen is not None:
+                self.bwd_iat.add((timestamp - self.bwd_last_seen) * 1000000)
+            self.bwd_last_seen = timestamp
             self.bwd_header_length += header_size
             if self.init_win_bytes_backward == 0:
                 self.init_win_bytes_backward = window_size
         
         # Update flags
-        if flags.get('PSH'):
-            self.psh_flags += 1
-            if direction == 'forward':
-                self.fwd_psh_flags += 1
-        if flags.get('URG'):
-            self.urg_flags += 1
-            if direction == 'forward':
-                self.fwd_urg_flags += 1
-        if flags.get('FIN'):
-            self.fin_flags += 1
-        if flags.get('SYN'):
-            self.syn_flags += 1
-        if flags.get('RST'):
-            self.rst_flags += 1
-        if flags.get('ACK'):
-            self.ack_flags += 1
-        if flags.get('CWE'):
-            self.cwe_flags += 1
-        if flags.get('ECE'):
-            self.ece_flags += 1
+        if flags:
+            key = flags | _FWD if direction == 'forward' else flags
+            self.flag_mask_counts[key] = self.flag_mask_counts.get(key, 0) + 1
         
         self.last_seen = timestamp
     
+    def flag_counts(self) -> Tuple[Dict[int, int], int, int]:
+        """
+        Expand flag mask counts into per-flag packet counts.
+        
+        Returns:
+            (counts, fwd_psh, fwd_urg): packets per TCP_* bit, and forward packets with PSH/URG
+        """
+        counts = dict.fromkeys(_MASK_BITS[0xFF], 0)
+        fwd_psh = fwd_urg = 0
+        for key, n in self.flag_mask_counts.items():
+            for bit in _MASK_BITS[key & 0xFF]:
+                counts[bit] += n
+            if key & _FWD:
+                if key & TCP_PSH:
+                    fwd_psh += n
+                if key & TCP_URG:
+                    fwd_urg += n
+        return counts, fwd_psh, fwd_urg
+    
     def to_feature_dict(self) -> Dict:
         """Convert flow to feature dictionary matching FEATURE_COLUMNS."""
-        import numpy as np
-        
-        flow_duration = (self.last_seen - self.first_seen).total_seconds() * 1000000  # microseconds
+        return dict(zip(FEATURE_COLUMNS, self.to_feature_row()))
+    
+    def to_feature_row(self) -> Tuple:
+        """Convert flow to a tuple of feature values in FEATURE_COLUMNS order."""
+        flow_duration = (self.last_seen - self.first_seen) * 1000000  # microseconds
         
-        # Calculate statistics
-        fwd_packet_lengths = np.array(self.fwd_packet_lengths) if self.fwd_packet_lengths else np.array([0])
-        bwd_packet_lengths = np.array(self.bwd_packet_lengths) if self.bwd_packet_lengths else np.array([0])
-        all_packet_lengths = np.concatenate([fwd_packet_lengths, bwd_packet_lengths]) if len(fwd_packet_lengths) > 0 or len(bwd_packet_lengths) > 0 else np.array([0])
+        # Length and IAT statistics (an empty direction counts as a single 0)
+        fwd_len, bwd_len = self.fwd_packet_lengths, self.bwd_packet_lengths
+        all_len = fwd_len.combine(bwd_len)
+        fwd_iat, bwd_iat = self.fwd_iat, self.bwd_iat
+        all_iat = fwd_iat.combine(bwd_iat)
         
-        # IAT (Inter-Arrival Time) calculations
-        fwd_iat = np.diff([ts.timestamp() for ts in self.fwd_timestamps]) * 1000000 if len(self.fwd_timestamps) > 1 else np.array([0])
-        bwd_iat = np.diff([ts.timestamp() for ts in self.bwd_timestamps]) * 1000000 if len(self.bwd_timestamps) > 1 else np.array([0])
-        all_iat = np.concatenate([fwd_iat, bwd_iat]) if len(fwd_iat) > 0 or len(bwd_iat) > 0 else np.array([0])
+        flags, fwd_psh_flags, fwd_urg_flags = self.flag_counts()
         
         # Flow rates
         flow_bytes_per_s = (self.total_fwd_bytes + self.total_bwd_bytes) / flow_duration * 1000000 if flow_duration > 0 else 0
         flow_packets_per_s = (self.total_fwd_packets + self.total_backward_packets) / flow_duration * 1000000 if flow_duration > 0 else 0
         
-        # Build feature dictionary
-        features = {
-            'Destination Port': self.dst_port,
-            'Flow Duration': int(flow_duration),
-            'Total Fwd Packets': self.total_fwd_packets,
-            'Total Backward Packets': self.total_backward_packets,
-            'Total Length of Fwd Packets': self.total_fwd_bytes,
-            'Total Length of Bwd Packets': self.total_bwd_bytes,
-            'Fwd Packet Length Max': int(fwd_packet_lengths.max()) if len(fwd_packet_lengths) > 0 else 0,
-            'Fwd Packet Length Min': int(fwd_packet_lengths.min()) if len(fwd_packet_lengths) > 0 else 0,
-            'Fwd Packet Length Mean': float(fwd_packet_lengths.mean()) if len(fwd_packet_lengths) > 0 else 0.0,
-            'Fwd Packet Length Std': float(fwd_packet_lengths.std()) if len(fwd_packet_lengths) > 0 else 0.0,
-            'Bwd Packet Length Max': int(bwd_packet_lengths.max()) if len(bwd_packet_lengths) > 0 else 0,
-            'Bwd Packet Length Min': int(bwd_packet_lengths.min()) if len(bwd_packet_lengths) > 0 else 0,
-            'Bwd Packet Length Mean': float(bwd_packet_lengths.mean()) if len(bwd_packet_lengths) > 0 else 0.0,
-            'Bwd Packet Length Std': float(bwd_packet_lengths.std()) if len(bwd_packet_lengths) > 0 else 0.0,
-            'Flow Bytes/s': flow_bytes_per_s if not np.isinf(flow_bytes_per_s) and not np.isnan(flow_bytes_per_s) else 0.0,
-            'Flow Packets/s': flow_packets_per_s if not np.isinf(flow_packets_per_s) and not np.isnan(flow_packets_per_s) else 0.0,
-            'Flow IAT Mean': float(all_iat.mean()) if len(all_iat) > 0 else 0.0,
-            'Flow IAT Std': float(all_iat.std()) if len(all_iat) > 0 else 0.0,
-            'Flow IAT Max': int(all_iat.max()) if len(all_iat) > 0 else 0,
-            'Flow IAT Min': int(all_iat.min()) if len(all_iat) > 0 else 0,
-            'Fwd IAT Total': int(fwd_iat.sum()) if len(fwd_iat) > 0 else 0,
-            'Fwd IAT Mean': float(fwd_iat.mean()) if len(fwd_iat) > 0 else 0.0,
-            'Fwd IAT Std': float(fwd_iat.std()) if len(fwd_iat) > 0 else 0.0,
-            'Fwd IAT Max': int(fwd_iat.max()) if len(fwd_iat) > 0 else 0,
-            'Fwd IAT Min': int(fwd_iat.min()) if len(fwd_iat) > 0 else 0,
-            'Bwd IAT Total': int(bwd_iat.sum()) if len(bwd_iat) > 0 else 0,
-            'Bwd IAT Mean': float(bwd_iat.mean()) if len(bwd_iat) > 0 else 0.0,
-            'Bwd IAT Std': float(bwd_iat.std()) if len(bwd_iat) > 0 else 0.0,
-            'Bwd IAT Max': int(bwd_iat.max()) if len(bwd_iat) > 0 else 0,
-            'Bwd IAT Min': int(bwd_iat.min()) if len(bwd_iat) > 0 else 0,
-            'Fwd PSH Flags': self.fwd_psh_flags,
-            'Fwd URG Flags': self.fwd_urg_flags,
-            'Fwd Header Length': self.fwd_header_length,
-            'Bwd Header Length': self.bwd_header_length,
-            'Fwd Packets/s': self.total_fwd_packets / flow_duration * 1000000 if flow_duration > 0 else 0.0,
-            'Bwd Packets/s': self.total_backward_packets / flow_duration * 1000000 if flow_duration > 0 else 0.0,
-            'Min Packet Length': int(all_packet_lengths.min()) if len(all_packet_lengths) > 0 else 0,
-            'Max Packet Length': int(all_packet_lengths.max()) if len(all_packet_lengths) > 0 else 0,
-            'Packet Length Mean': float(all_packet_lengths.mean()) if len(all_packet_lengths) > 0 else 0.0,
-            'Packet Length Std': float(all_packet_lengths.std()) if len(all_packet_lengths) > 0 else 0.0,
-            'Packet Length Variance': float(all_packet_lengths.var()) if len(all_packet_lengths) > 0 else 0.0,
-            'FIN Flag Count': self.fin_flags,
-            'SYN Flag Count': self.syn_flags,
-            'RST Flag Count': self.rst_flags,
-            'PSH Flag Count': self.psh_flags,
-            'ACK Flag Count': self.ack_flags,
-            'URG Flag Count': self.urg_flags,
-            'CWE Flag Count': self.cwe_flags,
-            'ECE Flag Count': self.ece_flags,
-            'Down/Up Ratio': self.total_fwd_packets / self.total_backward_packets if self.total_backward_packets > 0 else 0,
-            'Average Packet Size': float(all_packet_lengths.mean()) if len(all_packet_lengths) > 0 else 0.0,
-            'Avg Fwd Segment Size': float(fwd_packet_lengths.mean()) if len(fwd_packet_lengths) > 0 else 0.0,
-            'Avg Bwd Segment Size': float(bwd_packet_lengths.mean()) if len(bwd_packet_lengths) > 0 else 0.0,
-            'Fwd Header Length.1': self.fwd_header_length,  # Duplicate in original dataset
-            'Subflow Fwd Packets': self.subflow_fwd_packets,
-            'Subflow Fwd Bytes': self.subflow_fwd_bytes,
-            'Subflow Bwd Packets': self.subflow_bwd_packets,
-            'Subflow Bwd Bytes': self.subflow_bwd_bytes,
-            'Init_Win_bytes_forward': self.init_win_bytes_forward,
-            'Init_Win_bytes_backward': self.init_win_bytes_backward,
-            'act_data_pkt_fwd': self.act_data_pkt_fwd,
-            'min_seg_size_forward': self.min_seg_size_forward,
-            'Active Mean': float(np.mean(self.active_times)) if self.active_times else 0.0,
-            'Active Std': float(np.std(self.active_times)) if self.active_times else 0.0,
-            'Active Max': int(np.max(self.active_times)) if self.active_times else 0,
-            'Active Min': int(np.min(self.active_times)) if self.active_times else 0,
-            'Idle Mean': float(np.mean(self.idle_times)) if self.idle_times else 0.0,
-            'Idle Std': float(np.std(self.idle_times)) if self.idle_times else 0.0,
-            'Idle Max': int(np.max(self.idle_times)) if self.idle_times else 0,
-            'Idle Min': int(np.min(self.idle_times)) if self.idle_times else 0,
-        }
+        return (
+            self.dst_port,  # Destination Port
+            int(flow_duration),  # Flow Duration
+            self.total_fwd_packets,  # Total Fwd Packets
+            self.total_backward_packets,  # Total Backward Packets
+            self.total_fwd_bytes,  # Total Length of Fwd Packets
+            self.total_bwd_bytes,  # Total Length of Bwd Packets
+            int(fwd_len.max),  # Fwd Packet Length Max
+            int(fwd_len.min),  # Fwd Packet Length Min
+            fwd_len.mean,  # Fwd Packet Length Mean
+            fwd_len.std,  # Fwd Packet Length Std
+            int(bwd_len.max),  # Bwd Packet Length Max
+            int(bwd_len.min),  # Bwd Packet Length Min
+            bwd_len.mean,  # Bwd Packet Length Mean
+            bwd_len.std,  # Bwd Packet Length Std
+            flow_bytes_per_s if math.isfinite(flow_bytes_per_s) else 0.0,  # Flow Bytes/s
+            flow_packets_per_s if math.isfinite(flow_packets_per_s) else 0.0,  # Flow Packets/s
+            all_iat.mean,  # Flow IAT Mean
+            all_iat.std,  # Flow IAT Std
+            int(all_iat.max),  # Flow IAT Max
+            int(all_iat.min),  # Flow IAT Min
+            int(fwd_iat.total),  # Fwd IAT Total
+            fwd_iat.mean,  # Fwd IAT Mean
+            fwd_iat.std,  # Fwd IAT Std
+            int(fwd_iat.max),  # Fwd IAT Max
+            int(fwd_iat.min),  # Fwd IAT Min
+            int(bwd_iat.total),  # Bwd IAT Total
+            bwd_iat.mean,  # Bwd IAT Mean
+            bwd_iat.std,  # Bwd IAT Std
+            int(bwd_iat.max),  # Bwd IAT Max
+            int(bwd_iat.min),  # Bwd IAT Min
+            fwd_psh_flags,  # Fwd PSH Flags
+            fwd_urg_flags,  # Fwd URG Flags
+            self.fwd_header_length,  # Fwd Header Length
+            self.bwd_header_length,  # Bwd Header Length
+            self.total_fwd_packets / flow_duration * 1000000 if flow_duration > 0 else 0.0,  # Fwd Packets/s
+            self.total_backward_packets / flow_duration * 1000000 if flow_duration > 0 else 0.0,  # Bwd Packets/s
+            int(all_len.min),  # Min Packet Length
+            int(all_len.max),  # Max Packet Length
+            all_len.mean,  # Packet Length Mean
+            all_len.std,  # Packet Length Std
+            all_len.var,  # Packet Length Variance
+            flags[TCP_FIN],  # FIN Flag Count
+            flags[TCP_SYN],  # SYN Flag Count
+            flags[TCP_RST],  # RST Flag Count
+            flags[TCP_PSH],  # PSH Flag Count
+            flags[TCP_ACK],  # ACK Flag Count
+            flags[TCP_URG],  # URG Flag Count
+            flags[TCP_CWE],  # CWE Flag Count
+            flags[TCP_ECE],  # ECE Flag Count
+            self.total_fwd_packets / self.total_backward_packets if self.total_backward_packets > 0 else 0,  # Down/Up Ratio
+            all_len.mean,  # Average Packet Size
+            fwd_len.mean,  # Avg Fwd Segment Size
+            bwd_len.mean,  # Avg Bwd Segment Size
+            self.fwd_header_length,  # Fwd Header Length.1 (duplicate in original dataset)
+            self.subflow_fwd_packets,  # Subflow Fwd Packets
+            self.subflow_fwd_bytes,  # Subflow Fwd Bytes
+            self.subflow_bwd_packets,  # Subflow Bwd Packets
+            self.subflow_bwd_bytes,  # Subflow Bwd Bytes
+            self.init_win_bytes_forward,  # Init_Win_bytes_forward
+            self.init_win_bytes_backward,  # Init_Win_bytes_backward
+            self.act_data_pkt_fwd,  # act_data_pkt_fwd
+            self.min_seg_size_forward,  # min_seg_size_forward
+            float(np.mean(self.active_times)) if self.active_times else 0.0,  # Active Mean
+            float(np.std(self.active_times)) if self.active_times else 0.0,  # Active Std
+            int(np.max(self.active_times)) if self.active_times else 0,  # Active Max
+            int(np.min(self.active_times)) if self.active_times else 0,  # Active Min
+            float(np.mean(self.idle_times)) if self.idle_times else 0.0,  # Idle Mean
+            float(np.std(self.idle_times)) if self.idle_times else 0.0,  # Idle Std
+            int(np.max(self.idle_times)) if self.idle_times else 0,  # Idle Max
+            int(np.min(self.idle_times)) if self.idle_times else 0,  # Idle Min
+        )
+
+
+def build_flow_feature_matrix(flows: List[Flow]) -> np.ndarray:
+    """
+    Build the model feature matrix for a batch of flows, one row per flow.
+    
+    Args:
+        flows: Completed flows
         
-        return features
+    Returns:
+        float32 array of shape (len(flows), len(FEATURE_COLUMNS)) in FEATURE_COLUMNS order
+    """
+    # One conversion of all rows is much cheaper than assigning them one by one.
+    # Featurizing in worker processes doesn't pay off: pickling a Flow costs about as
+    # much as featurizing it
+    rows = [flow.to_feature_row() for flow in flows]
+    return np.array(rows, dtype=np.float32).reshape(len(flows), len(FEATURE_COLUMNS))
+
+
+class _FlowShard:
+    """
+    One partition of the flow table with its own lock.
+    
+    Besides the flows themselves it keeps indexes so expiry/flush touch only the flows
+    that are due instead of scanning the whole table. Heap entries are
+    (time, seq, key, flow); entries whose flow was already removed (or whose last_seen
+    moved on) are skipped or re-pushed lazily when they reach the top, and compact()
+    drops the removed ones early so flushed flows aren't kept alive until then.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flows: Dict[Tuple[str, str, int, int, str], Flow] = {}
+        self.idle_heap: list = []  # by last_seen (as of push)
+        self.age_heap: list = []  # by first_seen
+        self.ready: list = []  # (key, flow) that reached ready_min_packets
+    
+    def compact(self):
+        """
+        Rebuild the heaps without entries for removed flows once those outnumber the
+        live ones (call with the lock held). Each rebuild at least halves a heap, so
+        this is amortized O(1) per removed flow.
+        """
+        flows = self.flows
+        limit = 2 * len(flows) + _COMPACT_MIN_ENTRIES
+        if len(self.idle_heap) > limit:
+            self.idle_heap = [entry for entry in self.idle_heap if flows.get(entry[2]) is entry[3]]
+            heapq.heapify(self.idle_heap)
+        if len(self.age_heap) > limit:
+            self.age_heap = [entry for entry in self.age_heap if flows.get(entry[2]) is entry[3]]
+            heapq.heapify(self.age_heap)
 
 
 class FlowManager:
     """Manages network flows and expires idle flows."""
     
-    def __init__(self, idle_timeout: int = 60):
-        self.flows: Dict[Tuple[str, str, int, int, str], Flow] = {}
+    def __init__(
+        self,
+        idle_timeout: int = 60,
+        ready_min_packets: int = 5,
+        on_flow_ready: Optional[Callable[[], None]] = None,
+        num_shards: int = 16,
+    ):
         self.idle_timeout = idle_timeout
-        self.lock = threading.Lock()
+        # Flows with ready_min_packets packets are flushed by flush_active_flows.
+        # on_flow_ready is called (from the packet thread) when the first flow arrives
+        # in an empty table or a flow becomes ready, so consumers can flush promptly
+        self.ready_min_packets = ready_min_packets
+        self.on_flow_ready = on_flow_ready
+        
+        # The flow table is split into shards by address and port pair, each with its own lock, so
+        # packet ingest only contends with sweeps of the same shard
+        self._shards = [_FlowShard() for _ in range(num_shards)]
+        self._seq = itertools.count()
         self._running = False
         self._cleanup_thread = None
     
@@ -250,74 +377,117 @@ class FlowManager:
             return (dst_ip, src_ip, dst_port, src_port, protocol)
         return (src_ip, dst_ip, src_port, dst_port, protocol)
     
-    def add_packet(self, src_ip: str, dst_ip: str, src_port: int, dst_port: int, protocol: str, packet_info: Dict) -> Optional[Flow]:
+    def add_packet(self, src_ip: str, dst_ip: str, src_port: int, dst_port: int, protocol: str, packet_info: PacketInfo) -> Optional[Flow]:
         """Add a packet to a flow. Returns the flow if it was just expired."""
-        key = self.get_flow_key(src_ip, dst_ip, src_port, dst_port, protocol)
+        self.add_packets(((src_ip, dst_ip, src_port, dst_port, protocol, packet_info),))
+        return None
+    
+    def add_packets(self, packets: Iterable[Tuple[str, str, int, int, str, PacketInfo]]):
+        """
+        Add a batch of packets, each given as add_packet's arguments.
         
-        with self.lock:
-            if key not in self.flows:
-                self.flows[key] = Flow(src_ip, dst_ip, src_port, dst_port, protocol)
-            
-            flow = self.flows[key]
-            flow.add_packet(packet_info)
+        Cheaper per packet than add_packet for bursts: lookups are hoisted out of the
+        loop and on_flow_ready is called at most once per batch.
+        """
+        shards = self._shards
+        num_shards = len(shards)
+        get_flow_key = self.get_flow_key
+        ready_min_packets = self.ready_min_packets
+        notify = False
+        
+        for src_ip, dst_ip, src_port, dst_port, protocol, packet_info in packets:
+            key = get_flow_key(src_ip, dst_ip, src_port, dst_port, protocol)
+            # XOR is the same in both directions; the addresses spread portless flows (ICMP)
+            # and busy port pairs over the shards, and str hashes are cached so this doesn't
+            # hash the key a second time like hash(key) would
+            shard = shards[(hash(src_ip) ^ hash(dst_ip) ^ src_port ^ dst_port) % num_shards]
             
-            return None
+            with shard.lock:
+                flow = shard.flows.get(key)
+                if flow is None:
+                    # An empty shard is the only way an empty table can gain a flow
+                    notify = notify or not shard.flows
+                    flow = shard.flows[key] = Flow(
+                        src_ip, dst_ip, src_port, dst_port, protocol, packet_info.timestamp
+                    )
+                    seq = next(self._seq)
+                    heapq.heappush(shard.idle_heap, (flow.last_seen, seq, key, flow))
+                    heapq.heappush(shard.age_heap, (flow.first_seen, seq, key, flow))
+                
+                flow.add_packet(packet_info)
+                if flow.total_fwd_packets + flow.total_backward_packets == ready_min_packets:
+                    shard.ready.append((key, flow))
+                    notify = True
+        
+        if notify and self.on_flow_ready:
+            self.on_flow_ready()
     
     def expire_flows(self) -> list[Flow]:
         """Expire flows that have been idle too long. Returns expired flows."""
-        now = datetime.utcnow()
+        now = time.monotonic()
         expired = []
         
-        with self.lock:
-            keys_to_remove = []
-            for key, flow in self.flows.items():
-                idle_time = (now - flow.last_seen).total_seconds()
-                if idle_time > self.idle_timeout:
-                    expired.append(flow)
-                    keys_to_remove.append(key)
-            
-            for key in keys_to_remove:
-                del self.flows[key]
+        for shard in self._shards:
+            with shard.lock:
+                heap = shard.idle_heap
+                while heap and now - heap[0][0] > self.idle_timeout:
+                    _, _, key, flow = heapq.heappop(heap)
+                    if shard.flows.get(key) is not flow:
+                        continue  # already flushed/expired
+                    if now - flow.last_seen > self.idle_timeout:
+                        del shard.flows[key]
+                        expired.append(flow)
+                    else:
+                        # Seen since this entry was pushed; check again when it could be idle
+                        heapq.heappush(heap, (flow.last_seen, next(self._seq), key, flow))
         
         return expired
     
-    def flush_active_flows(self, min_packets: int = 5, max_age_seconds: int = 10) -> list[Flow]:
-        """Flush active flows that have enough packets or are old enough. Returns flushed flows."""
-        now = datetime.utcnow()
+    def flush_active_flows(self, max_age_seconds: int = 10) -> list[Flow]:
+        """
+        Flush active flows that have ready_min_packets packets or are old enough.
+        Returns flushed flows.
+        """
+        now = time.monotonic()
         flushed = []
         
-        with self.lock:
-            keys_to_remove = []
-            for key, flow in self.flows.items():
-                age = (now - flow.first_seen).total_seconds()
-                # Calculate total packet count from forward and backward packets
-                packet_count = flow.total_fwd_packets + flow.total_backward_packets
+        for shard in self._shards:
+            with shard.lock:
+                # Flows that reached ready_min_packets
+                for key, flow in shard.ready:
+                    if shard.flows.get(key) is flow:
+                        del shard.flows[key]
+                        flushed.append(flow)
+                shard.ready.clear()
                 
-                # Flush if flow has enough packets OR is old enough
-                if packet_count >= min_packets or age >= max_age_seconds:
-                    flushed.append(flow)
-                    keys_to_remove.append(key)
-            
-            for key in keys_to_remove:
-                del self.flows[key]
+                # Flows that are old enough
+                heap = shard.age_heap
+                while heap and now - heap[0][0] >= max_age_seconds:
+                    _, _, key, flow = heapq.heappop(heap)
+                    if shard.flows.get(key) is flow:
+                        del shard.flows[key]
+                        flushed.append(flow)
+                
+                # Flows flushed as ready still have idle (and maybe age) heap entries
+                shard.compact()
         
         return flushed
     
     def get_expired_flows(self) -> list[Flow]:
         """Get expired flows without removing them (for inspection)."""
-        now = datetime.utcnow()
+        now = time.monotonic()
         expired = []
         
-        with self.lock:
-            for flow in self.flows.values():
-                idle_time = (now - flow.last_seen).total_seconds()
-                if idle_time > self.idle_timeout:
-                    expired.append(flow)
+        for shard in self._shards:
+            with shard.lock:
+                for flow in shard.flows.values():
+                    idle_time = now - flow.last_seen
+                    if idle_time > self.idle_timeout:
+                        expired.append(flow)
         
         return expired
     
     def get_active_flow_count(self) -> int:
         """Get number of active flows."""
-        with self.lock:
-            return len(self.flows)
-
+        # len() of each shard's dict is atomic, so no locks are needed for a snapshot
+        return sum(len(shard.flows) for shard in self._shards)
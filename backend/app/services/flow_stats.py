@@ -0,0 +1,69 @@
+"""Online (single-pass) summary statistics for per-flow featurization."""
+import math
+
+
+class RunningStats:
+    """
+    Count, sum, mean, variance, min and max of a stream, updated in O(1) per value
+    with Welford's algorithm so flows never keep per-packet samples.
+
+    An empty stream reports 0 for every statistic.
+    """
+
+    __slots__ = ("n", "total", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = 0.0
+        self.max = 0.0
+
+    def add(self, x: float):
+        """Add one value to the stream."""
+        n = self.n + 1
+        self.n = n
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (x - self.mean)
+        if n == 1:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+
+    @property
+    def var(self) -> float:
+        """Population variance (matches numpy's var())."""
+        return self.m2 / self.n if self.n else 0.0
+
+    @property
+    def std(self) -> float:
+        """Population standard deviation (matches numpy's std())."""
+        return math.sqrt(self.var)
+
+    def combine(self, other: "RunningStats") -> "RunningStats":
+        """
+        Statistics of both streams together, where an empty stream counts as a
+        single 0 (how the feature set has always treated a direction with no packets).
+        """
+        a = self if self.n else _ZERO
+        b = other if other.n else _ZERO
+
+        out = RunningStats()
+        out.n = a.n + b.n
+        out.total = a.total + b.total
+        delta = b.mean - a.mean
+        out.mean = a.mean + delta * b.n / out.n
+        out.m2 = a.m2 + b.m2 + delta * delta * a.n * b.n / out.n
+        out.min = min(a.min, b.min)
+        out.max = max(a.max, b.max)
+        return out
+
+
+# Statistics of the single value 0
+_ZERO = RunningStats()
+_ZERO.add(0.0)
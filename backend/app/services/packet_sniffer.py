@@ -1,7 +1,16 @@
 """Packet sniffer for live network monitoring."""
+import ctypes
+import functools
+import mmap
+import select
+import socket
+import struct
 import threading
+import time
+from collections import deque
 from typing import Callable, Optional
-from datetime import datetime
+
+from app.services.flow_manager import PacketInfo
 
 try:
     from scapy.all import sniff, IP, TCP, UDP, ICMP
@@ -10,38 +19,190 @@ except ImportError:
     SCAPY_AVAILABLE = False
     print("Warning: scapy not available. Install with: pip install scapy")
 
+# Raw AF_PACKET sockets (Linux only) let us skip scapy's per-packet dissection
+RAW_SOCKET_AVAILABLE = hasattr(socket, "AF_PACKET")
+
+_ETH_P_ALL = 0x0003
+_ETH_P_IP = 0x0800
+_ETH_P_8021Q = 0x8100
+# Link types (/sys/class/net/<interface>/type) whose frames start with an Ethernet header;
+# loopback frames carry a zeroed one
+_ETHERNET_LINK_TYPES = (1, 772)  # ARPHRD_ETHER, ARPHRD_LOOPBACK
+_RAW_BUFFER_SIZE = 65536  # largest IPv4 packet plus link header
+_RAW_SOCKET_RCVBUF = 8 * 1024 * 1024
+
+# PACKET_MMAP (TPACKET_V3) receive ring: the kernel copies frames into blocks of a buffer
+# shared with us and hands over whole blocks, so a busy link costs no system call per packet
+_SOL_PACKET = 263
+_PACKET_RX_RING = 5
+_PACKET_VERSION = 10
+_TPACKET_V3 = 2
+_TP_STATUS_KERNEL = 0
+_TP_STATUS_USER = 1
+_RING_BLOCK_SIZE = 256 * 1024  # fits the largest frame, so none are truncated
+_RING_BLOCK_COUNT = 32  # 8 MiB in all, like _RAW_SOCKET_RCVBUF
+_RING_FRAME_SIZE = 2048  # only used by the kernel to size the ring; V3 frames are packed
+_RING_BLOCK_TIMEOUT_MS = 10  # a partly filled block is handed over after this long
+_TPACKET_REQ3 = struct.Struct("7I")  # struct tpacket_req3
+_BLOCK_STATUS = struct.Struct("I")  # tpacket_block_desc: block_status at offset 8
+_BLOCK_HEADER = struct.Struct("8xIII")  # ... block_status, num_pkts, offset_to_first_pkt
+_TPACKET3_HEADER = struct.Struct("IIIIIIH")  # next_offset, sec, nsec, snaplen, len, status, mac
+
+# Most packets handed to the flow manager in one add_packets call
+_PARSE_BATCH_SIZE = 64
+
+# Only IPv4 TCP/UDP/ICMP packets are turned into flows; everything else is dropped in
+# the kernel before it is copied to us
+_CAPTURE_FILTER = "ip and (tcp or udp or icmp)"
+
+# _CAPTURE_FILTER as a classic BPF program for Ethernet frames (optionally with one VLAN
+# tag), as (code, jump if true, jump if false, k); jumps are relative to the next instruction
+_SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26)
+_CAPTURE_FILTER_BPF = (
+    (0x28, 0, 0, 12),  # 0: ldh [12] (ethertype)
+    (0x15, 0, 2, 0x0800),  # 1: jeq IPv4 -> 2, else -> 4
+    (0x30, 0, 0, 23),  # 2: ldb [23] (IP protocol)
+    (0x05, 0, 0, 4),  # 3: ja 8
+    (0x15, 0, 7, 0x8100),  # 4: jeq VLAN -> 5, else drop
+    (0x28, 0, 0, 16),  # 5: ldh [16] (ethertype after the tag)
+    (0x15, 0, 5, 0x0800),  # 6: jeq IPv4 -> 7, else drop
+    (0x30, 0, 0, 27),  # 7: ldb [27] (IP protocol)
+    (0x15, 2, 0, 6),  # 8: jeq TCP -> accept
+    (0x15, 1, 0, 17),  # 9: jeq UDP -> accept
+    (0x15, 0, 1, 1),  # 10: jeq ICMP -> accept, else drop
+    (0x06, 0, 0, 0x40000),  # 11: accept (whole frame)
+    (0x06, 0, 0, 0),  # 12: drop
+)
+
+_IP_PROTOCOLS = {1: "ICMP", 6: "TCP", 17: "UDP"}
+
+# Header fields we need, as offsets into the frame buffer
+# Ethernet type, then the IPv4 version/IHL, flags/fragment offset, protocol, src and dst,
+# read in one call for untagged frames (and for frames with one VLAN tag)
+_ETH_IPV4_HEADER = struct.Struct("!12xHB5xHxB2x4s4s")
+_VLAN_IPV4_HEADER = struct.Struct("!16xHB5xHxB2x4s4s")
+_TCP_HEADER = struct.Struct("!HH9xBH")  # ports, flags byte, window
+_UDP_HEADER = struct.Struct("!HH")  # ports
+
+
+def _attach_capture_filter(sock: socket.socket):
+    """Attach _CAPTURE_FILTER_BPF to a raw AF_PACKET socket."""
+    program = b"".join(struct.pack("HBBI", *insn) for insn in _CAPTURE_FILTER_BPF)
+    buf = ctypes.create_string_buffer(program, len(program))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }
+    fprog = struct.pack("HL", len(_CAPTURE_FILTER_BPF), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, _SO_ATTACH_FILTER, fprog)
+
+
+def _link_type(interface: str) -> Optional[int]:
+    """ARPHRD_* link type of a network interface, or None if it can't be read."""
+    try:
+        with open(f"/sys/class/net/{interface}/type") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _ip_to_str(address: bytes) -> str:
+    """
+    Dotted-quad string for a packed IPv4 address.
+    
+    Cached because traffic mostly comes from a few hosts: their packets then share one
+    string (whose hash is computed once for flow lookups) instead of converting it again.
+    """
+    return socket.inet_ntoa(address)
+
+
+def _map_rx_ring(sock: socket.socket) -> mmap.mmap:
+    """Set up a TPACKET_V3 receive ring on a raw AF_PACKET socket and map it."""
+    sock.setsockopt(_SOL_PACKET, _PACKET_VERSION, _TPACKET_V3)
+    sock.setsockopt(_SOL_PACKET, _PACKET_RX_RING, _TPACKET_REQ3.pack(
+        _RING_BLOCK_SIZE,
+        _RING_BLOCK_COUNT,
+        _RING_FRAME_SIZE,
+        _RING_BLOCK_SIZE * _RING_BLOCK_COUNT // _RING_FRAME_SIZE,
+        _RING_BLOCK_TIMEOUT_MS,
+        0,  # no private area per block
+        0,  # no extra features
+    ))
+    return mmap.mmap(sock.fileno(), _RING_BLOCK_SIZE * _RING_BLOCK_COUNT)
+
 
 class PacketSniffer:
     """Packet sniffer that captures packets and feeds them to a flow manager."""
     
-    def __init__(self, interface: str, flow_manager, on_flow_complete: Callable):
+    def __init__(
+        self,
+        interface: str,
+        flow_manager,
+        on_flow_complete: Callable,
+        raw_socket: bool = True,
+        queue_size: int = 8192,
+    ):
         self.interface = interface
         self.flow_manager = flow_manager
         self.on_flow_complete = on_flow_complete
+        # Capture from a raw AF_PACKET socket where available; scapy's sniff() otherwise
+        self.raw_socket = raw_socket and RAW_SOCKET_AVAILABLE
+        # Capture path for the current start(): raw_socket unless the interface isn't Ethernet
+        self._use_raw = self.raw_socket
         self._running = False
         self._sniff_thread: Optional[threading.Thread] = None
+        self._parse_thread: Optional[threading.Thread] = None
+        
+        # The capture thread only timestamps and queues packets; the parse thread turns them
+        # into flow updates. One parse thread keeps each flow's packets in capture order.
+        # deque append/popleft are atomic, so no lock is needed
+        self._packets: deque = deque(maxlen=queue_size)
+        self._packets_ready = threading.Event()
+        
+        # One PacketInfo per batch slot, refilled for every batch; only the parse thread
+        # uses them and the flow manager copies the fields out before add_packets returns
+        self._packet_infos = [PacketInfo() for _ in range(_PARSE_BATCH_SIZE)]
+        
         self._packet_count = 0
         self._processed_count = 0
+        self._dropped_count = 0
         self._last_error: Optional[str] = None
     
     def start(self):
         """Start packet sniffing."""
-        if not SCAPY_AVAILABLE:
+        if not self.raw_socket and not SCAPY_AVAILABLE:
             raise RuntimeError("scapy is not installed. Install with: pip install scapy")
         
         if self._running:
             return
         
+        self._use_raw = self.raw_socket
+        if self._use_raw:
+            # The raw socket path parses Ethernet headers by hand; tunnels, PPP, Wi-Fi
+            # monitor mode etc. have other link layers that scapy can dissect
+            link_type = _link_type(self.interface)
+            if link_type is not None and link_type not in _ETHERNET_LINK_TYPES:
+                if SCAPY_AVAILABLE:
+                    print(f"⚠ Warning: Interface '{self.interface}' is not Ethernet (link type {link_type}); capturing with scapy")
+                    self._use_raw = False
+                else:
+                    print(f"⚠ Warning: Interface '{self.interface}' is not Ethernet (link type {link_type}); its packets will not be parsed")
+        
         self._running = True
-        self._sniff_thread = threading.Thread(target=self._sniff_loop, daemon=True)
+        self._packets.clear()
+        self._parse_thread = threading.Thread(target=self._parse_loop, daemon=True)
+        self._parse_thread.start()
+        target = self._raw_sniff_loop if self._use_raw else self._sniff_loop
+        self._sniff_thread = threading.Thread(target=target, daemon=True)
         self._sniff_thread.start()
         print(f"✓ Started packet sniffer on interface: {self.interface}")
     
     def stop(self):
         """Stop packet sniffing."""
         self._running = False
+        self._packets_ready.set()
         if self._sniff_thread:
             self._sniff_thread.join(timeout=2)
+        if self._parse_thread:
+            self._parse_thread.join(timeout=2)
     
     def _sniff_loop(self):
         """Main sniffing loop."""
@@ -53,108 +214,225 @@ class PacketSniffer:
                 print(f"⚠ Warning: Interface '{self.interface}' not found. Available interfaces: {available_interfaces}")
                 print(f"   Sniffer will continue but may fail. Consider setting INTERFACE_NAME to a valid interface.")
             
-            sniff(
+            sniff_args = dict(
                 iface=self.interface,
-                prn=self._process_packet,
+                prn=self._enqueue,
                 store=False,
                 stop_filter=lambda x: not self._running,
             )
-        except OSError as e:
+            try:
+                sniff(filter=_CAPTURE_FILTER, **sniff_args)
+            except ImportError as e:
+                # scapy compiles filters with libpcap; without it, filter in Python only
+                print(f"⚠ Warning: Cannot use capture filter ({e}); filtering packets in Python")
+                sniff(**sniff_args)
+        except Exception as e:
+            self._handle_sniff_error(e)
+    
+    def _raw_sniff_loop(self):
+        """Sniffing loop on a raw AF_PACKET socket, parsing headers by hand (Linux)."""
+        try:
+            with socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(_ETH_P_ALL)) as sock:
+                sock.bind((self.interface, 0))
+                _attach_capture_filter(sock)
+                try:
+                    ring = _map_rx_ring(sock)
+                except OSError as e:
+                    print(f"⚠ Warning: Cannot map a capture ring ({e}); receiving packets one at a time")
+                else:
+                    with ring:
+                        self._read_rx_ring(sock, ring)
+                    return
+                
+                # Room to absorb bursts while this thread waits for the GIL (capped by net.core.rmem_max)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _RAW_SOCKET_RCVBUF)
+                sock.settimeout(0.5)  # Wake up regularly to notice stop()
+                
+                # One receive buffer, reused for every frame; only the frame itself is copied out
+                buf = bytearray(_RAW_BUFFER_SIZE)
+                while self._running:
+                    try:
+                        size = sock.recv_into(buf)
+                    except socket.timeout:
+                        continue
+                    self._enqueue(buf[:size])
+        except Exception as e:
+            self._handle_sniff_error(e)
+    
+    def _read_rx_ring(self, sock: socket.socket, ring: mmap.mmap):
+        """Queue frames from a mapped TPACKET_V3 ring (see _map_rx_ring) until stopped."""
+        poller = select.poll()
+        poller.register(sock, select.POLLIN | select.POLLERR)
+        enqueue = self._enqueue
+        block = 0
+        while self._running:
+            block_offset = block * _RING_BLOCK_SIZE
+            status, num_packets, offset = _BLOCK_HEADER.unpack_from(ring, block_offset)
+            if not status & _TP_STATUS_USER:
+                poller.poll(500)  # Wake up regularly to notice stop()
+                continue
+            
+            # Frames carry kernel (wall clock) timestamps; flows are timed on the monotonic clock
+            clock_offset = time.monotonic() - time.time()
+            offset += block_offset
+            for _ in range(num_packets):
+                next_offset, sec, nsec, snaplen, _, _, mac = _TPACKET3_HEADER.unpack_from(ring, offset)
+                start = offset + mac
+                enqueue(ring[start:start + snaplen], sec + nsec * 1e-9 + clock_offset)
+                offset += next_offset
+            
+            # Hand the block back to the kernel
+            _BLOCK_STATUS.pack_into(ring, block_offset + 8, _TP_STATUS_KERNEL)
+            block = (block + 1) % _RING_BLOCK_COUNT
+    
+    def _enqueue(self, packet, timestamp: Optional[float] = None):
+        """Queue a captured packet (raw frame or scapy packet) for the parse thread."""
+        self._packet_count += 1
+        if len(self._packets) == self._packets.maxlen:
+            self._dropped_count += 1  # The oldest queued packet is about to be dropped
+        self._packets.append((packet, time.monotonic() if timestamp is None else timestamp))
+        if not self._packets_ready.is_set():
+            self._packets_ready.set()
+    
+    def _parse_loop(self):
+        """Parse queued packets into flow updates until stopped."""
+        process = self._process_frame if self._use_raw else self._process_packet
+        add_packets = self.flow_manager.add_packets
+        packet_infos = self._packet_infos
+        packets = self._packets
+        ready = self._packets_ready
+        batch = []
+        while self._running:
+            # Parse whatever is already queued (up to a batch) and add it in one call;
+            # never wait for more packets to fill a batch
+            while packets and len(batch) < _PARSE_BATCH_SIZE:
+                packet, timestamp = packets.popleft()
+                parsed = process(packet, timestamp, packet_infos[len(batch)])
+                if parsed is not None:
+                    batch.append(parsed)
+            
+            if batch:
+                add_packets(batch)
+                batch.clear()
+                continue
+            
+            # Clear before re-checking so a packet queued in between isn't missed
+            ready.clear()
+            if not packets:
+                ready.wait(0.5)
+    
+    def _handle_sniff_error(self, e: Exception):
+        """Record a fatal sniffing error and stop."""
+        error_msg = str(e)
+        self._last_error = error_msg
+        if isinstance(e, OSError):
             # Handle permission/interface errors gracefully
-            error_msg = str(e)
-            self._last_error = error_msg
             if "BIOCSETIF" in error_msg or "Operation not permitted" in error_msg:
                 print(f"⚠ Permission error: Cannot access interface '{self.interface}'")
                 print(f"   Run with sudo or grant network permissions to your terminal/IDE.")
                 print(f"   Example: sudo uvicorn app.main:app --reload")
             else:
                 print(f"⚠ Interface error: {error_msg}")
-            self._running = False
-        except Exception as e:
-            error_msg = str(e)
-            self._last_error = error_msg
+        else:
             print(f"⚠ Error in packet sniffer: {error_msg}")
             import traceback
             traceback.print_exc()
-            self._running = False
+        self._running = False
     
-    def _process_packet(self, packet):
-        """Process a single packet."""
-        if not self._running:
-            return
-        
-        self._packet_count += 1
+    def _process_frame(self, buf: bytearray, timestamp: float, packet_info: PacketInfo) -> Optional[tuple]:
+        """
+        Parse a single raw Ethernet frame captured at timestamp (monotonic).
         
+        Returns:
+            add_packets arguments for the packet (with packet_info filled in), or None to skip it
+        """
         try:
-            # Extract IP layer
-            if IP not in packet:
+            # Ethernet and IPv4 headers, optionally with one VLAN tag in between
+            ethertype, version_ihl, fragment, proto, src, dst = _ETH_IPV4_HEADER.unpack_from(buf)
+            offset = 14
+            if ethertype == _ETH_P_8021Q:
+                ethertype, version_ihl, fragment, proto, src, dst = _VLAN_IPV4_HEADER.unpack_from(buf)
+                offset = 18
+            if ethertype != _ETH_P_IP:
                 return
             
-            ip_layer = packet[IP]
-            src_ip = ip_layer.src
-            dst_ip = ip_layer.dst
-            protocol = "Unknown"
+            protocol = _IP_PROTOCOLS.get(proto)
+            if protocol is None or fragment & 0x1FFF:
+                return  # Skip non-TCP/UDP/ICMP, and fragments without a transport header
+            
+            header_size = (version_ihl & 0x0F) * 4
+            transport = offset + header_size
+            src_port = dst_port = flags = window_size = 0
+            if proto == 6:
+                src_port, dst_port, flags, window_size = _TCP_HEADER.unpack_from(buf, transport)
+            elif proto == 17:
+                src_port, dst_port = _UDP_HEADER.unpack_from(buf, transport)
+            
+            return self._parsed_packet(
+                _ip_to_str(src), _ip_to_str(dst), src_port, dst_port, protocol,
+                len(buf), header_size, flags, window_size, timestamp, packet_info,
+            )
+        
+        except Exception as e:
+            # Log errors for debugging
+            if self._packet_count <= 10:
+                print(f"  [Sniffer] Error processing packet: {e}")
+            self._last_error = str(e)
+    
+    def _process_packet(self, packet, timestamp: float, packet_info: PacketInfo) -> Optional[tuple]:
+        """Parse a single scapy packet captured at timestamp (monotonic), like _process_frame."""
+        try:
+            # Extract IP layer: normally right under the link layer, else one walk down the chain
+            ip_layer = packet.payload
+            if type(ip_layer) is not IP:
+                ip_layer = packet.getlayer(IP)
+                if ip_layer is None:
+                    return
+            
+            # Read values straight from the layers' dissected fields: attribute access on a
+            # scapy packet goes through __getattr__ and costs about 1 us per field
+            ip_fields = ip_layer.fields
+            src_ip = ip_fields["src"]
+            dst_ip = ip_fields["dst"]
             src_port = 0
             dst_port = 0
             
-            # Extract protocol and ports
-            if TCP in packet:
+            # Extract protocol and ports from the layer right above IP, instead of
+            # searching the whole packet for each protocol
+            transport = ip_layer.payload
+            transport_type = type(transport)
+            if transport_type is TCP:
+                transport_fields = transport.fields
                 protocol = "TCP"
-                tcp_layer = packet[TCP]
-                src_port = tcp_layer.sport
-                dst_port = tcp_layer.dport
-                flags = {
-                    'FIN': bool(tcp_layer.flags & 0x01),
-                    'SYN': bool(tcp_layer.flags & 0x02),
-                    'RST': bool(tcp_layer.flags & 0x04),
-                    'PSH': bool(tcp_layer.flags & 0x08),
-                    'ACK': bool(tcp_layer.flags & 0x10),
-                    'URG': bool(tcp_layer.flags & 0x20),
-                    'ECE': bool(tcp_layer.flags & 0x40),
-                    'CWE': bool(tcp_layer.flags & 0x80),
-                }
-                window_size = tcp_layer.window
-            elif UDP in packet:
+                src_port = transport_fields["sport"]
+                dst_port = transport_fields["dport"]
+                # TCP flags byte (see flow_manager.TCP_*); scapy's value also carries the NS bit
+                flags = transport_fields["flags"].value & 0xFF
+                window_size = transport_fields["window"]
+            elif transport_type is UDP:
+                transport_fields = transport.fields
                 protocol = "UDP"
-                udp_layer = packet[UDP]
-                src_port = udp_layer.sport
-                dst_port = udp_layer.dport
-                flags = {}
+                src_port = transport_fields["sport"]
+                dst_port = transport_fields["dport"]
+                flags = 0
                 window_size = 0
-            elif ICMP in packet:
+            elif transport_type is ICMP:
                 protocol = "ICMP"
-                flags = {}
+                flags = 0
                 window_size = 0
             else:
-                return  # Skip non-TCP/UDP/ICMP
-            
-            # Determine direction (simplified: assume first packet is forward)
-            # In a real system, you'd track connection state
-            direction = "forward" if src_port < dst_port or src_ip < dst_ip else "backward"
+                return  # Skip non-TCP/UDP/ICMP (and fragments without a transport header)
             
-            # Calculate packet size
-            packet_size = len(packet)
-            header_size = len(ip_layer) - (len(ip_layer.payload) if hasattr(ip_layer, 'payload') else 0)
+            # Calculate packet size from the captured bytes and the IP header length field;
+            # len() on a scapy packet rebuilds it (and each of its layers) from the fields
+            original = packet.original
+            packet_size = len(original) if original is not None else len(packet)
+            header_size = ip_fields["ihl"] * 4
             
-            # Build packet info
-            packet_info = {
-                'direction': direction,
-                'size': packet_size,
-                'header_size': header_size,
-                'flags': flags,
-                'timestamp': datetime.utcnow(),
-                'window_size': window_size,
-            }
-            
-            # Add to flow manager
-            self.flow_manager.add_packet(
-                src_ip, dst_ip, src_port, dst_port, protocol, packet_info
+            return self._parsed_packet(
+                src_ip, dst_ip, src_port, dst_port, protocol,
+                packet_size, header_size, flags, window_size, timestamp, packet_info,
             )
-            self._processed_count += 1
-            
-            # Log first few packets for debugging
-            if self._processed_count <= 5:
-                print(f"  [Sniffer] Processed packet #{self._processed_count}: {src_ip}:{src_port} -> {dst_ip}:{dst_port} ({protocol})")
         
         except Exception as e:
             # Log errors for debugging
@@ -162,11 +440,47 @@ class PacketSniffer:
                 print(f"  [Sniffer] Error processing packet: {e}")
             self._last_error = str(e)
     
+    def _parsed_packet(
+        self,
+        src_ip: str,
+        dst_ip: str,
+        src_port: int,
+        dst_port: int,
+        protocol: str,
+        packet_size: int,
+        header_size: int,
+        flags: int,
+        window_size: int,
+        timestamp: float,
+        packet_info: PacketInfo,
+    ) -> tuple:
+        """Fill packet_info for a parsed packet and return its add_packets arguments."""
+        # Determine direction (simplified: assume first packet is forward)
+        # In a real system, you'd track connection state
+        direction = "forward" if src_port < dst_port or src_ip < dst_ip else "backward"
+        
+        # Fill packet info
+        packet_info.direction = direction
+        packet_info.size = packet_size
+        packet_info.header_size = header_size
+        packet_info.flags = flags
+        packet_info.timestamp = timestamp
+        packet_info.window_size = window_size
+        
+        self._processed_count += 1
+        
+        # Log first few packets for debugging
+        if self._processed_count <= 5:
+            print(f"  [Sniffer] Processed packet #{self._processed_count}: {src_ip}:{src_port} -> {dst_ip}:{dst_port} ({protocol})")
+        
+        return (src_ip, dst_ip, src_port, dst_port, protocol, packet_info)
+    
     def get_stats(self):
         """Get sniffer statistics."""
         return {
             "packet_count": self._packet_count,
             "processed_count": self._processed_count,
+            "dropped_count": self._dropped_count,
             "last_error": self._last_error,
         }
 
@@ -0,0 +1,183 @@
+"""Packet sniffer that captures and tracks flows in a child process."""
+import multiprocessing
+import queue
+import signal
+import threading
+from typing import Callable, List, NamedTuple, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.services.flow_manager import FlowManager, build_flow_feature_matrix
+from app.services.packet_sniffer import PacketSniffer
+
+# How often the child checks for stop() and reports its stats (seconds)
+_POLL_INTERVAL = 0.5
+
+
+class FlowSummary(NamedTuple):
+    """The parts of a completed flow that its event needs besides the prediction."""
+    src_ip: str
+    dst_ip: str
+    src_port: int
+    dst_port: int
+    protocol: str
+
+
+def _sniffer_process_main(interface: str, raw_socket: bool, queue_size: int, out_queue, stop_event):
+    """
+    Child process entry point: capture packets, track flows and send completed ones.
+    
+    Puts ("flows", summaries, features) for every batch of completed flows and
+    ("stats", stats) after each poll on out_queue, until stop_event is set or
+    the sniffer fails.
+    """
+    # Ctrl+C reaches the whole process group; the parent stops us through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    flow_wakeup = threading.Event()
+    flow_manager = FlowManager(
+        idle_timeout=settings.FLOW_IDLE_TIMEOUT,
+        ready_min_packets=settings.FLOW_FLUSH_MIN_PACKETS,
+        on_flow_ready=flow_wakeup.set,
+    )
+    sniffer = PacketSniffer(
+        interface=interface,
+        flow_manager=flow_manager,
+        on_flow_complete=None,
+        raw_socket=raw_socket,
+        queue_size=queue_size,
+    )
+    
+    def send_flows(flows):
+        if flows:
+            summaries = [
+                FlowSummary(flow.src_ip, flow.dst_ip, flow.src_port, flow.dst_port, flow.protocol)
+                for flow in flows
+            ]
+            out_queue.put(("flows", summaries, build_flow_feature_matrix(flows)))
+    
+    def send_stats():
+        stats = sniffer.get_stats()
+        stats["active_flows"] = flow_manager.get_active_flow_count()
+        out_queue.put(("stats", stats))
+    
+    try:
+        sniffer.start()
+        while sniffer._running and not stop_event.is_set():
+            flow_wakeup.wait(_POLL_INTERVAL)
+            flow_wakeup.clear()
+            send_flows(
+                flow_manager.expire_flows()
+                + flow_manager.flush_active_flows(max_age_seconds=settings.FLOW_FLUSH_MAX_AGE)
+            )
+            send_stats()
+    except Exception as e:
+        sniffer._handle_sniff_error(e)
+    finally:
+        sniffer.stop()
+        # Flows still open die with this process, so predict them now
+        send_flows(flow_manager.flush_active_flows(max_age_seconds=0))
+        send_stats()
+
+
+class ProcessPacketSniffer:
+    """
+    PacketSniffer run in a child process, for use in place of one.
+    
+    Capture, header parsing, flow tracking and featurization all hold the GIL, so
+    with a busy interface they compete with the API for it. Here they run in a
+    separate process (with its own flow manager) that only sends back completed
+    flows as feature rows, which a reader thread hands to on_flows.
+    """
+    
+    def __init__(
+        self,
+        interface: str,
+        on_flows: Callable[[List[FlowSummary], np.ndarray], None],
+        raw_socket: bool = True,
+        queue_size: int = 8192,
+    ):
+        self.interface = interface
+        self.on_flows = on_flows
+        self.raw_socket = raw_socket
+        self.queue_size = queue_size
+        # spawn, not fork: the parent has the event loop and model threads running
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self._stop_event = None
+        self._reader_thread: Optional[threading.Thread] = None
+        self._stats = {
+            "packet_count": 0,
+            "processed_count": 0,
+            "dropped_count": 0,
+            "last_error": None,
+            "active_flows": 0,
+        }
+    
+    @property
+    def _running(self) -> bool:
+        """Whether the child process is capturing (it exits on stop() or a sniffing error)."""
+        return (
+            self._process is not None
+            and self._process.is_alive()
+            and not self._stop_event.is_set()
+        )
+    
+    def start(self):
+        """Start the sniffer process."""
+        if self._running:
+            return
+        
+        out_queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._process = self._context.Process(
+            target=_sniffer_process_main,
+            args=(self.interface, self.raw_socket, self.queue_size, out_queue, self._stop_event),
+            daemon=True,
+        )
+        self._process.start()
+        self._reader_thread = threading.Thread(
+            target=self._read_loop, args=(self._process, out_queue), daemon=True
+        )
+        self._reader_thread.start()
+        print(f"✓ Started packet sniffer process on interface: {self.interface}")
+    
+    def stop(self):
+        """
+        Stop the sniffer process, handing off the flows it still had open.
+        
+        Blocks (for up to 5 seconds) until the process and the reader thread are done,
+        so every on_flows call has been made when it returns; call it from a worker
+        thread in async code.
+        """
+        if self._process is None:
+            return
+        self._stop_event.set()
+        self._process.join(timeout=3)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._reader_thread.join(timeout=2)
+    
+    def _read_loop(self, process, out_queue):
+        """Dispatch the child's messages until it has exited and its queue is drained."""
+        while True:
+            try:
+                message = out_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive():
+                    return
+                continue
+            
+            if message[0] == "flows":
+                _, summaries, features = message
+                try:
+                    self.on_flows(summaries, features)
+                except Exception as e:
+                    print(f"⚠ Error handing off {len(summaries)} flows from sniffer process: {e}")
+            else:
+                self._stats = message[1]
+    
+    def get_stats(self):
+        """Get sniffer statistics (as last reported by the child process)."""
+        return dict(self._stats)
@@ -1,11 +1,28 @@
 """In-memory event store for predictions."""
-from collections import deque
+import sys
+from collections import Counter, deque
+from itertools import islice
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from app.config import settings
+
+
+# Low-cardinality string fields shared by all events via sys.intern
+_INTERNED_FIELDS = ("protocol", "attack_type", "severity")
+
 
 class PredictionStore:
-    """In-memory event store for predictions."""
+    """
+    In-memory event store for predictions.
+    
+    Not thread-safe by design: every read and write happens on the event loop (the
+    sniffer thread hands completed flows back with run_coroutine_threadsafe, and the
+    prediction, history and stats routes are async), so the running aggregates and
+    event ids never see interleaved updates. Code running in other threads must go
+    through the loop (e.g. loop.call_soon_threadsafe) rather than call it directly.
+    Returned events are the stored dicts and must not be mutated.
+    """
     
     def __init__(self, maxlen: int = 2000):
         """
@@ -15,6 +32,13 @@ class PredictionStore:
             maxlen: Maximum number of events to store (default: 2000)
         """
         self.events = deque(maxlen=maxlen)
+        
+        # Events are numbered 1, 2, ... as they are added; the newest one's id is the version
+        self._version = 0
+        
+        # Running aggregates over the stored window, so get_stats is O(1)
+        self._total_attacks = 0
+        self._attack_types: Counter = Counter()
     
     def add_event(self, event: Dict):
         """
@@ -25,25 +49,59 @@ class PredictionStore:
                 - timestamp (or will be set to current time)
                 - src_ip, dst_ip, src_port, dst_port, protocol
                 - is_attack, attack_type, binary_confidence, severity
+        
+        Events are trusted as-is: only the app's own prediction paths add them,
+        and readers such as /predictions/history serialize them without validation.
         """
         # Ensure timestamp exists
         if "timestamp" not in event or event["timestamp"] is None:
             event["timestamp"] = datetime.utcnow().isoformat()
         
+        # One shared string object per distinct value (e.g. protocols parsed from API requests)
+        for field in _INTERNED_FIELDS:
+            value = event.get(field)
+            if type(value) is str:
+                event[field] = sys.intern(value)
+        
+        # The oldest event falls off the right when full; remove it from the aggregates
+        if len(self.events) == self.events.maxlen:
+            self._count_event(self.events[-1], -1)
+        
         # Add event at the left (newest first)
         self.events.appendleft(event)
+        self._count_event(event, 1)
+        self._version += 1
+    
+    def _count_event(self, event: Dict, delta: int):
+        """Add (delta=1) or remove (delta=-1) an event from the running aggregates."""
+        if not event.get("is_attack", False):
+            return
+        self._total_attacks += delta
+        attack_type = event.get("attack_type", "Unknown")
+        self._attack_types[attack_type] += delta
+        if self._attack_types[attack_type] <= 0:
+            del self._attack_types[attack_type]
+    
+    @property
+    def version(self) -> int:
+        """Number of events ever added, which is also the id of the newest event."""
+        return self._version
     
-    def get_recent(self, limit: int = 100) -> List[Dict]:
+    def get_recent(self, limit: int = 100, since_id: Optional[int] = None) -> List[Dict]:
         """
         Get recent prediction events.
         
         Args:
             limit: Maximum number of events to return (default: 100)
+            since_id: Only return events added after the event with this id
             
         Returns:
-            List of event dictionaries, newest first
+            List of event dictionaries, newest first; the i-th (from 0) has id version - i
         """
-        return list(self.events)[:limit]
+        limit = max(limit, 0)  # islice rejects negative stops
+        if since_id is not None:
+            limit = min(limit, max(self._version - since_id, 0))
+        return list(islice(self.events, limit))
     
     def get_all(self) -> List[Dict]:
         """
@@ -56,7 +114,7 @@ class PredictionStore:
     
     def get_stats(self) -> Dict:
         """
-        Compute statistics from stored events.
+        Get statistics over stored events (maintained incrementally by add_event).
         
         Returns:
             Dictionary with stats:
@@ -65,20 +123,15 @@ class PredictionStore:
                 - attack_ratio: Percentage of attacks
                 - attack_type_distribution: Count by attack type
         """
-        events = list(self.events)
-        total_flows = len(events)
-        attacks = [e for e in events if e.get("is_attack", False)]
-        total_attacks = len(attacks)
+        total_flows = len(self.events)
+        total_attacks = self._total_attacks
         attack_ratio = (total_attacks / total_flows * 100) if total_flows > 0 else 0.0
         
         # Attack type distribution
-        attack_type_dist = {}
-        for event in attacks:
-            attack_type = event.get("attack_type", "Unknown")
-            attack_type_dist[attack_type] = attack_type_dist.get(attack_type, 0) + 1
+        attack_type_dist = dict(self._attack_types)
         
         # Most frequent attack type
-        most_frequent = max(attack_type_dist.items(), key=lambda x: x[1])[0] if attack_type_dist else "N/A"
+        most_frequent = self._attack_types.most_common(1)[0][0] if self._attack_types else "N/A"
         
         return {
             "total_flows": total_flows,
@@ -90,5 +143,5 @@ class PredictionStore:
 
 
 # Global instance
-prediction_store = PredictionStore()
+prediction_store = PredictionStore(maxlen=settings.PREDICTION_STORE_SIZE)
 
@@ -0,0 +1,105 @@
+"""Tests for the micro-batching prediction scheduler."""
+import asyncio
+import threading
+
+import numpy as np
+
+from app.services.batch_scheduler import BatchScheduler
+
+
+class _RecordingModel:
+    """predict_matrix stand-in that records batch sizes and returns each row's sum."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, features: np.ndarray) -> list:
+        self.batch_sizes.append(len(features))
+        return features.sum(axis=1).tolist()
+
+
+def _vectors(n: int) -> list:
+    return [np.full(4, i, dtype=np.float32) for i in range(n)]
+
+
+def test_concurrent_submissions_share_one_call():
+    model = _RecordingModel()
+
+    async def run():
+        scheduler = BatchScheduler(model, max_batch_size=32, batch_timeout_ms=50)
+        scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(vec) for vec in _vectors(5)))
+        finally:
+            await scheduler.stop()
+
+    assert asyncio.run(run()) == [0, 4, 8, 12, 16]
+    assert model.batch_sizes == [5]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    model = _RecordingModel()
+
+    async def run():
+        scheduler = BatchScheduler(model, max_batch_size=2, batch_timeout_ms=50)
+        scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(vec) for vec in _vectors(5)))
+        finally:
+            await scheduler.stop()
+
+    assert asyncio.run(run()) == [0, 4, 8, 12, 16]
+    assert model.batch_sizes == [2, 2, 1]
+
+
+def test_model_errors_reach_every_request_in_the_batch():
+    def failing_model(features):
+        raise ValueError("model failed")
+
+    async def run():
+        scheduler = BatchScheduler(failing_model, batch_timeout_ms=50)
+        scheduler.start()
+        try:
+            return await asyncio.gather(
+                *(scheduler.submit(vec) for vec in _vectors(3)), return_exceptions=True
+            )
+        finally:
+            await scheduler.stop()
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError] * 3
+
+
+def test_stop_fails_in_flight_and_queued_requests():
+    release = threading.Event()
+    calls = []
+
+    def blocking_model(features):
+        calls.append(len(features))
+        release.wait(5)
+        return [0.0] * len(features)
+
+    async def run():
+        scheduler = BatchScheduler(blocking_model, max_batch_size=2, batch_timeout_ms=1)
+        scheduler.start()
+        tasks = [asyncio.create_task(scheduler.submit(vec)) for vec in _vectors(5)]
+        # Wait until the first batch is being predicted; the other requests stay queued
+        while not calls:
+            await asyncio.sleep(0.01)
+        try:
+            await scheduler.stop()
+            return await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=2)
+        finally:
+            release.set()  # let the worker thread finish so the loop can close
+
+    results = asyncio.run(run())
+    assert calls == [2]
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_submit_before_start_predicts_directly():
+    model = _RecordingModel()
+    scheduler = BatchScheduler(model)
+
+    assert asyncio.run(scheduler.submit(np.arange(4, dtype=np.float32))) == 6
+    assert model.batch_sizes == [1]
@@ -0,0 +1,64 @@
+"""Tests for flow tracking in the flow manager."""
+import gc
+import time
+import weakref
+
+from app.ml.preprocessing import FEATURE_COLUMNS
+from app.services.flow_manager import _COMPACT_MIN_ENTRIES, FlowManager, PacketInfo
+
+
+def _only_flow(flow_manager):
+    flows = flow_manager.flush_active_flows(max_age_seconds=0)
+    assert len(flows) == 1
+    return flows[0]
+
+
+def test_flow_starts_at_first_packet_timestamp():
+    # Packets are timestamped at capture, which can be well before the flow is created
+    captured = time.monotonic() - 5
+    flow_manager = FlowManager()
+    flow_manager.add_packet("10.0.0.1", "10.0.0.2", 40000, 80, "TCP", PacketInfo("forward", 60, 20, 0x02, captured))
+    flow_manager.add_packet("10.0.0.2", "10.0.0.1", 80, 40000, "TCP", PacketInfo("backward", 60, 20, 0x12, captured + 0.25))
+
+    features = _only_flow(flow_manager).to_feature_dict()
+    assert features["Flow Duration"] >= 0
+    assert features["Flow Duration"] == 250000
+
+
+def test_single_packet_flow_has_zero_duration():
+    flow_manager = FlowManager()
+    flow_manager.add_packet("10.0.0.1", "10.0.0.2", 0, 0, "ICMP", PacketInfo("forward", 84, 20, 0, time.monotonic() - 1))
+
+    row = _only_flow(flow_manager).to_feature_row()
+    assert len(row) == len(FEATURE_COLUMNS)
+    assert row[FEATURE_COLUMNS.index("Flow Duration")] == 0
+
+
+def test_both_directions_share_one_flow():
+    flow_manager = FlowManager()
+    for i in range(4):
+        flow_manager.add_packet("10.0.0.1", "10.0.0.2", 0, 0, "ICMP", PacketInfo("forward", 84, 20, 0, None))
+        flow_manager.add_packet("10.0.0.2", "10.0.0.1", 0, 0, "ICMP", PacketInfo("backward", 84, 20, 0, None))
+
+    flow = _only_flow(flow_manager)
+    assert flow.total_fwd_packets == 4
+    assert flow.total_backward_packets == 4
+
+
+def test_flushed_flows_are_not_kept_alive_by_heaps():
+    flow_manager = FlowManager(idle_timeout=60, ready_min_packets=2)
+    refs = []
+    for round in range(20):
+        for port in range(200):
+            for direction in ("forward", "backward"):
+                flow_manager.add_packet("10.0.0.1", "10.0.0.2", 1024 + round * 200 + port, 80, "TCP", PacketInfo(direction, 60, 20, 0, None))
+        flushed = flow_manager.flush_active_flows(max_age_seconds=60)
+        assert len(flushed) == 200
+        refs += [weakref.ref(flow) for flow in flushed]
+        del flushed
+    gc.collect()
+
+    # Well within idle_timeout, yet only the few dead entries each shard tolerates before
+    # compacting still reference flushed flows (none are live)
+    tolerated = _COMPACT_MIN_ENTRIES * len(flow_manager._shards)
+    assert sum(ref() is not None for ref in refs) <= tolerated < len(refs) // 2
@@ -0,0 +1,65 @@
+"""Tests for the online summary statistics used in flow featurization."""
+import numpy as np
+import pytest
+
+from app.services.flow_stats import RunningStats
+
+
+def _stats(values) -> RunningStats:
+    stats = RunningStats()
+    for x in values:
+        stats.add(x)
+    return stats
+
+
+def _assert_matches(stats: RunningStats, values):
+    values = np.asarray(values, dtype=np.float64)
+    assert stats.n == len(values)
+    assert stats.total == pytest.approx(values.sum())
+    assert stats.mean == pytest.approx(values.mean())
+    assert stats.var == pytest.approx(np.var(values))
+    assert stats.std == pytest.approx(np.std(values))
+    assert stats.min == values.min()
+    assert stats.max == values.max()
+
+
+@pytest.mark.parametrize("values", [
+    [1500.0],
+    [60, 60, 60, 60],
+    [60, 1500, 52, 1448, 40, 576],
+    np.random.default_rng(0).exponential(20000, 500).tolist(),  # IAT-like, microseconds
+    [1e9 + x for x in (4, 7, 13, 16)],  # large offset, small spread
+])
+def test_matches_numpy(values):
+    _assert_matches(_stats(values), values)
+
+
+def test_empty_reports_zero():
+    stats = RunningStats()
+    assert (stats.n, stats.total, stats.mean, stats.var, stats.std, stats.min, stats.max) == (0, 0, 0, 0, 0, 0, 0)
+
+
+def test_combine_matches_numpy():
+    fwd = [60, 1500, 1500, 52]
+    bwd = [40, 40, 576, 1448, 1448, 90]
+    _assert_matches(_stats(fwd).combine(_stats(bwd)), fwd + bwd)
+
+
+@pytest.mark.parametrize("empty_side", ["left", "right"])
+def test_combine_with_empty_side_counts_it_as_zero(empty_side):
+    values = [60, 1500, 52]
+    stats = _stats(values)
+    combined = RunningStats().combine(stats) if empty_side == "left" else stats.combine(RunningStats())
+    # An empty direction contributes a single 0, as the feature set has always done
+    _assert_matches(combined, values + [0.0])
+
+
+def test_combine_both_empty():
+    _assert_matches(RunningStats().combine(RunningStats()), [0.0, 0.0])
+
+
+def test_combine_leaves_inputs_unchanged():
+    a, b = _stats([1, 2, 3]), _stats([10, 20])
+    a.combine(b)
+    _assert_matches(a, [1, 2, 3])
+    _assert_matches(b, [10, 20])
@@ -0,0 +1,59 @@
+"""Tests for the health and sniffer control routes."""
+import socket
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.routers import health
+
+
+class _StubSniffer:
+    def __init__(self):
+        self.interface = "eth-old"
+        self._running = False
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "INTERFACE_NAME", settings.INTERFACE_NAME)
+    app = FastAPI()
+    app.include_router(health.router)
+    app.state.sniffer = _StubSniffer()
+    yield TestClient(app)
+    health.list_interfaces.cache_clear()
+
+
+@pytest.fixture
+def without_scapy(monkeypatch):
+    monkeypatch.setattr(health, "get_if_list", None)
+    health.list_interfaces.cache_clear()
+
+
+def test_interfaces_listed_without_scapy(without_scapy):
+    assert health.list_interfaces() == [name for _, name in socket.if_nameindex()]
+
+
+def test_set_interface_without_scapy(without_scapy, client):
+    interface = socket.if_nameindex()[0][1]
+    response = client.post("/health/sniffer/interface", params={"interface": interface})
+    assert response.status_code == 200
+    assert response.json()["status"] == "updated"
+    assert client.app.state.sniffer.interface == interface
+
+
+def test_set_interface_rejects_unknown(without_scapy, client):
+    response = client.post("/health/sniffer/interface", params={"interface": "no-such-nic0"})
+    assert response.status_code == 400
+
+
+def test_set_interface_when_interfaces_cannot_be_listed(monkeypatch, client):
+    def fail():
+        raise OSError("no interface list")
+    monkeypatch.setattr(health, "get_if_list", fail)
+    health.list_interfaces.cache_clear()
+
+    response = client.post("/health/sniffer/interface", params={"interface": "eth7"})
+    assert response.status_code == 200
+    assert client.app.state.sniffer.interface == "eth7"
@@ -0,0 +1,293 @@
+"""Tests for the raw capture path of the packet sniffer: frame parsing, filter and ring."""
+import os
+import socket
+import struct
+import time
+
+import pytest
+
+from app.services.flow_manager import FlowManager, PacketInfo
+from app.services import packet_sniffer
+from app.services.packet_sniffer import PacketSniffer
+
+
+def _ethernet(payload: bytes, ethertype: int = 0x0800, vlan: bool = False) -> bytearray:
+    header = b"\x02\x00\x00\x00\x00\x02" + b"\x02\x00\x00\x00\x00\x01"
+    if vlan:
+        header += struct.pack("!HH", 0x8100, 42)
+    return bytearray(header + struct.pack("!H", ethertype) + payload)
+
+
+def _ipv4(proto: int, payload: bytes, src="10.0.0.1", dst="10.0.0.2", fragment=0, options=b"") -> bytes:
+    ihl = 5 + len(options) // 4
+    header = struct.pack(
+        "!BBHHHBBH4s4s", 0x40 | ihl, 0, ihl * 4 + len(payload), 1, fragment, 64, proto, 0,
+        socket.inet_aton(src), socket.inet_aton(dst),
+    )
+    return header + options + payload
+
+
+def _tcp(src_port: int, dst_port: int, flags: int, window: int) -> bytes:
+    return struct.pack("!HHIIBBHHH", src_port, dst_port, 1000, 0, 0x50, flags, window, 0, 0)
+
+
+def _udp(src_port: int, dst_port: int, payload: bytes = b"") -> bytes:
+    return struct.pack("!HHHH", src_port, dst_port, 8 + len(payload), 0) + payload
+
+
+_ICMP_ECHO = bytes([8, 0, 0, 0, 0, 1, 0, 1])
+
+
+@pytest.fixture
+def sniffer():
+    return PacketSniffer("lo", FlowManager(), None)
+
+
+def _parse(sniffer, frame):
+    return sniffer._process_frame(frame, 12.5, PacketInfo())
+
+
+def test_tcp_frame(sniffer):
+    frame = _ethernet(_ipv4(6, _tcp(40000, 443, 0x18, 501)))
+    src_ip, dst_ip, src_port, dst_port, protocol, info = _parse(sniffer, frame)
+    assert (src_ip, dst_ip, src_port, dst_port, protocol) == ("10.0.0.1", "10.0.0.2", 40000, 443, "TCP")
+    assert (info.size, info.header_size, info.flags, info.window_size) == (len(frame), 20, 0x18, 501)
+    assert info.timestamp == 12.5
+    assert info.direction == "forward"  # lower source address
+
+
+def test_udp_frame(sniffer):
+    frame = _ethernet(_ipv4(17, _udp(53, 5353, b"query")))
+    src_ip, dst_ip, src_port, dst_port, protocol, info = _parse(sniffer, frame)
+    assert (src_ip, dst_ip, src_port, dst_port, protocol) == ("10.0.0.1", "10.0.0.2", 53, 5353, "UDP")
+    assert (info.size, info.header_size, info.flags, info.window_size) == (len(frame), 20, 0, 0)
+    assert info.direction == "forward"
+
+
+def test_icmp_frame_has_no_ports(sniffer):
+    frame = _ethernet(_ipv4(1, _ICMP_ECHO, src="192.168.1.9", dst="192.168.1.1"))
+    src_ip, dst_ip, src_port, dst_port, protocol, info = _parse(sniffer, frame)
+    assert (src_ip, dst_ip, src_port, dst_port, protocol) == ("192.168.1.9", "192.168.1.1", 0, 0, "ICMP")
+    assert info.size == len(frame)
+
+
+def test_vlan_tagged_frame(sniffer):
+    frame = _ethernet(_ipv4(6, _tcp(80, 51000, 0x12, 65535)), vlan=True)
+    src_ip, dst_ip, src_port, dst_port, protocol, info = _parse(sniffer, frame)
+    assert (src_port, dst_port, protocol) == (80, 51000, "TCP")
+    assert (info.flags, info.window_size) == (0x12, 65535)
+
+
+def test_ip_options_are_skipped(sniffer):
+    frame = _ethernet(_ipv4(6, _tcp(40000, 22, 0x02, 1024), options=b"\x01\x01\x01\x00"))
+    _, _, src_port, dst_port, _, info = _parse(sniffer, frame)
+    assert (src_port, dst_port) == (40000, 22)
+    assert info.header_size == 24
+
+
+@pytest.mark.parametrize("frame", [
+    _ethernet(b"\x00" * 28, ethertype=0x0806),  # ARP
+    _ethernet(b"\x60" + b"\x00" * 47, ethertype=0x86DD),  # IPv6
+    _ethernet(_ipv4(47, b"\x00" * 8)),  # GRE
+    _ethernet(_ipv4(17, b"\x00" * 8, fragment=185)),  # later fragment, no UDP header
+], ids=["arp", "ipv6", "gre", "fragment"])
+def test_skipped_frames(sniffer, frame):
+    assert _parse(sniffer, frame) is None
+    assert sniffer._processed_count == 0
+
+
+def test_truncated_frame_is_skipped(sniffer):
+    frame = _ethernet(_ipv4(6, _tcp(40000, 443, 0x18, 501)))[:40]
+    assert _parse(sniffer, frame) is None
+    assert sniffer.get_stats()["last_error"] is not None
+
+
+def _run_bpf(program, frame: bytes) -> int:
+    """Run a classic BPF program (only the instructions the capture filter uses) on a frame."""
+    pc = acc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code == 0x28:  # ldh [k]
+            if k + 2 > len(frame):
+                return 0
+            acc = struct.unpack_from("!H", frame, k)[0]
+        elif code == 0x30:  # ldb [k]
+            if k + 1 > len(frame):
+                return 0
+            acc = frame[k]
+        elif code == 0x15:  # jeq #k
+            pc += jt if acc == k else jf
+        elif code == 0x05:  # ja k
+            pc += k
+        elif code == 0x06:  # ret #k
+            return k
+        else:
+            raise AssertionError(f"unexpected BPF opcode {code:#x}")
+
+
+_ACCEPTED_FRAMES = {
+    "tcp": _ethernet(_ipv4(6, _tcp(40000, 443, 0x18, 501))),
+    "udp": _ethernet(_ipv4(17, _udp(53, 5353))),
+    "icmp": _ethernet(_ipv4(1, _ICMP_ECHO)),
+    "vlan-tcp": _ethernet(_ipv4(6, _tcp(80, 51000, 0x12, 65535)), vlan=True),
+    "vlan-udp": _ethernet(_ipv4(17, _udp(123, 123)), vlan=True),
+}
+_REJECTED_FRAMES = {
+    "arp": _ethernet(b"\x00" * 28, ethertype=0x0806),
+    "ipv6": _ethernet(b"\x60" + b"\x00" * 47, ethertype=0x86DD),
+    "gre": _ethernet(_ipv4(47, b"\x00" * 8)),
+    "vlan-gre": _ethernet(_ipv4(47, b"\x00" * 8), vlan=True),
+    "vlan-ipv6": _ethernet(b"\x60" + b"\x00" * 47, ethertype=0x86DD, vlan=True),
+    "runt": bytearray(b"\x00" * 10),
+}
+
+
+@pytest.mark.parametrize("name", _ACCEPTED_FRAMES)
+def test_capture_filter_accepts(name):
+    assert _run_bpf(packet_sniffer._CAPTURE_FILTER_BPF, _ACCEPTED_FRAMES[name]) > 0
+
+
+@pytest.mark.parametrize("name", _REJECTED_FRAMES)
+def test_capture_filter_rejects(name):
+    assert _run_bpf(packet_sniffer._CAPTURE_FILTER_BPF, _REJECTED_FRAMES[name]) == 0
+
+
+needs_raw_lo = pytest.mark.skipif(
+    not packet_sniffer.RAW_SOCKET_AVAILABLE or not os.path.exists("/sys/class/net/lo") or os.geteuid() != 0,
+    reason="needs AF_PACKET sockets on lo as root",
+)
+
+
+@needs_raw_lo
+def test_capture_filter_in_kernel():
+    # Frames sent on lo are looped back to every packet socket bound to it
+    marker = os.urandom(6)
+    frames = {
+        name: bytes(frame[:6]) + marker + bytes(frame[12:])
+        for name, frame in {**_ACCEPTED_FRAMES, **_REJECTED_FRAMES}.items()
+        if len(frame) >= 14
+    }
+    with socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0003)) as rx, \
+            socket.socket(socket.AF_PACKET, socket.SOCK_RAW) as tx:
+        rx.bind(("lo", 0))
+        packet_sniffer._attach_capture_filter(rx)
+        # Drain anything captured between bind and attaching the filter
+        rx.setblocking(False)
+        try:
+            while rx.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+
+        tx.bind(("lo", 0))
+        for frame in frames.values():
+            tx.send(frame)
+
+        received = set()
+        rx.settimeout(0.5)
+        try:
+            while True:
+                frame = rx.recv(65536)
+                if frame[6:12] == marker:
+                    received.add(frame)
+        except socket.timeout:
+            pass
+
+    assert {name for name, frame in frames.items() if frame in received} == set(_ACCEPTED_FRAMES)
+
+
+def _fill_block(ring: bytearray, block: int, frames, sec: int):
+    """Write frames into a ring block as the kernel would and hand it to user space."""
+    block_offset = block * packet_sniffer._RING_BLOCK_SIZE
+    first = 48  # past struct tpacket_block_desc
+    offset = block_offset + first
+    for i, frame in enumerate(frames):
+        mac = 80  # tpacket3_hdr plus sockaddr_ll, aligned
+        next_offset = (mac + len(frame) + 15) // 16 * 16 if i < len(frames) - 1 else 0
+        packet_sniffer._TPACKET3_HEADER.pack_into(
+            ring, offset, next_offset, sec, i * 1000000, len(frame), len(frame), 0, mac
+        )
+        ring[offset + mac:offset + mac + len(frame)] = frame
+        offset += next_offset
+    packet_sniffer._BLOCK_HEADER.pack_into(
+        ring, block_offset, packet_sniffer._TP_STATUS_USER, len(frames), first
+    )
+
+
+def test_read_rx_ring(sniffer):
+    ring = bytearray(packet_sniffer._RING_BLOCK_SIZE * packet_sniffer._RING_BLOCK_COUNT)
+    block_frames = [
+        [_ACCEPTED_FRAMES["tcp"], _ACCEPTED_FRAMES["udp"], _ACCEPTED_FRAMES["icmp"]],
+        [_ACCEPTED_FRAMES["vlan-tcp"], _ACCEPTED_FRAMES["vlan-udp"]],
+    ]
+    sec = int(time.time())
+    for block, frames in enumerate(block_frames):
+        _fill_block(ring, block, frames, sec)
+    expected = [bytes(frame) for frames in block_frames for frame in frames]
+
+    received = []
+
+    def enqueue(packet, timestamp=None):
+        received.append((bytes(packet), timestamp))
+        if len(received) == len(expected):
+            sniffer._running = False
+
+    sniffer._enqueue = enqueue
+    sniffer._running = True
+    a, b = socket.socketpair()
+    with a, b:
+        sniffer._read_rx_ring(a, ring)
+
+    assert [frame for frame, _ in received] == expected
+    # Kernel wall-clock timestamps (sec, nsec) become monotonic ones
+    clock_offset = time.monotonic() - time.time()
+    assert received[1][1] - received[0][1] == pytest.approx(1e-3, abs=1e-6)
+    assert received[0][1] == pytest.approx(sec + clock_offset, abs=1)
+    # Both blocks were handed back to the kernel
+    for block in range(len(block_frames)):
+        status, _, _ = packet_sniffer._BLOCK_HEADER.unpack_from(ring, block * packet_sniffer._RING_BLOCK_SIZE)
+        assert status == packet_sniffer._TP_STATUS_KERNEL
+
+
+@needs_raw_lo
+def test_raw_capture_through_ring():
+    flow_manager = FlowManager()
+    sniffer = PacketSniffer("lo", flow_manager, None, raw_socket=True)
+    sniffer.start()
+    try:
+        time.sleep(0.2)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for _ in range(20):
+                sock.sendto(b"ring", ("127.0.0.1", 9))
+        # Flows are flushed every ready_min_packets packets, so count across all of them
+        deadline = time.monotonic() + 5
+        captured = 0
+        while captured < 20 and time.monotonic() < deadline:
+            time.sleep(0.1)
+            for flow in flow_manager.flush_active_flows(max_age_seconds=0):
+                if flow.dst_port == 9 or flow.src_port == 9:
+                    captured += flow.total_fwd_packets + flow.total_backward_packets
+    finally:
+        sniffer.stop()
+
+    assert sniffer.get_stats()["last_error"] is None
+    assert captured >= 20
+
+
+@pytest.mark.skipif(
+    not packet_sniffer.RAW_SOCKET_AVAILABLE or not packet_sniffer.SCAPY_AVAILABLE,
+    reason="needs both capture paths",
+)
+def test_capture_path_is_chosen_per_start(sniffer, monkeypatch):
+    loops = []
+    sniffer._raw_sniff_loop = lambda: loops.append("raw")
+    sniffer._sniff_loop = lambda: loops.append("scapy")
+
+    for link_type in (65534, 1):  # tun, then Ethernet after an interface change
+        monkeypatch.setattr(packet_sniffer, "_link_type", lambda interface: link_type)
+        sniffer.start()
+        sniffer.stop()
+
+    assert loops == ["scapy", "raw"]
+    assert sniffer.raw_socket
@@ -0,0 +1,33 @@
+"""Tests for the in-memory prediction store."""
+import pytest
+from pydantic import ValidationError
+
+from app.config import Settings
+from app.store.prediction_store import PredictionStore
+
+
+def _event(attack_type: str = "BENIGN") -> dict:
+    return {
+        "src_ip": "10.0.0.1", "dst_ip": "10.0.0.2", "src_port": 40000, "dst_port": 80,
+        "protocol": "TCP", "is_attack": attack_type != "BENIGN", "attack_type": attack_type,
+        "binary_confidence": 0.9, "severity": "high" if attack_type != "BENIGN" else "none",
+    }
+
+
+def test_full_store_evicts_oldest_from_stats():
+    store = PredictionStore(maxlen=2)
+    store.add_event(_event("DoS"))
+    store.add_event(_event())
+    store.add_event(_event("PortScan"))  # evicts the DoS event
+
+    stats = store.get_stats()
+    assert stats["total_flows"] == 2
+    assert stats["total_attacks"] == 1
+    assert stats["most_frequent_attack"] == "PortScan"
+    assert [event["attack_type"] for event in store.get_recent(10)] == ["PortScan", "BENIGN"]
+
+
+@pytest.mark.parametrize("size", [0, -1])
+def test_store_size_must_be_positive(size):
+    with pytest.raises(ValidationError):
+        Settings(PREDICTION_STORE_SIZE=size)
@@ -0,0 +1,154 @@
+"""Tests for the prediction routes."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.ml.predictor import PredictionResult
+from app.routers import predictions
+from app.store.prediction_store import PredictionStore
+
+
+def _event(i: int) -> dict:
+    return {
+        "src_ip": "10.0.0.1", "dst_ip": "10.0.0.2", "src_port": 40000 + i, "dst_port": 80,
+        "protocol": "TCP", "is_attack": False, "attack_type": "BENIGN",
+        "binary_confidence": 0.1, "severity": "none",
+    }
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = PredictionStore(maxlen=100)
+    monkeypatch.setattr(predictions, "prediction_store", store)
+    return store
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(predictions.router)
+    return TestClient(app)
+
+
+def test_history_not_modified_for_current_etag(store, client):
+    store.add_event(_event(1))
+    response = client.get("/predictions/history")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    assert client.get("/predictions/history", headers={"If-None-Match": etag}).status_code == 304
+    store.add_event(_event(2))
+    assert client.get("/predictions/history", headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("if_none_match", [
+    '"other", {etag}',
+    '{etag},W/"other"',
+    '{strong}',
+    '*',
+])
+def test_history_if_none_match_forms(store, client, if_none_match):
+    store.add_event(_event(1))
+    etag = client.get("/predictions/history").headers["etag"]
+    header = if_none_match.format(etag=etag, strong=etag.removeprefix("W/"))
+    assert client.get("/predictions/history", headers={"If-None-Match": header}).status_code == 304
+
+
+def test_history_etag_from_another_process_does_not_match(store, client, monkeypatch):
+    store.add_event(_event(1))
+    etag = client.get("/predictions/history").headers["etag"]
+
+    # A restarted process has a new epoch but numbers its events from 1 again
+    monkeypatch.setattr(predictions, "_ETAG_EPOCH", "restarted")
+    response = client.get("/predictions/history", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_history_rejects_negative_limit(store, client):
+    assert client.get("/predictions/history?limit=-1").status_code == 422
+    assert client.get("/predictions/history?since_id=-1").status_code == 422
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """The prediction cache, emptied, on a fake clock with a 60 s TTL and room for 3 entries."""
+    clock = _FakeClock()
+    monkeypatch.setattr(predictions, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(predictions, "_PRED_CACHE", type(predictions._PRED_CACHE)())
+    monkeypatch.setattr(settings, "PREDICT_CACHE_TTL_SECONDS", 60)
+    monkeypatch.setattr(settings, "PREDICT_CACHE_SIZE", 3)
+    return clock
+
+
+def _result(attack_type: str = "BENIGN") -> PredictionResult:
+    return PredictionResult(
+        is_attack=attack_type != "BENIGN", attack_type=attack_type,
+        binary_confidence=0.2, class_probabilities={attack_type: 1.0},
+    )
+
+
+def test_cache_hit_on_same_feature_bytes(cache):
+    features = np.arange(5, dtype=np.float32)
+    result = _result()
+    predictions._cache_put(predictions._cache_key(features), result)
+
+    assert predictions._cache_get(predictions._cache_key(features.copy())) is result
+    assert predictions._cache_get(predictions._cache_key(features + 1)) is None
+
+
+def test_cache_entries_expire_after_ttl(cache):
+    key = predictions._cache_key(np.zeros(5, dtype=np.float32))
+    predictions._cache_put(key, _result())
+
+    cache.now += 60
+    assert predictions._cache_get(key) is not None
+    cache.now += 0.5
+    assert predictions._cache_get(key) is None
+    assert key not in predictions._PRED_CACHE
+
+
+def test_cache_evicts_least_recently_used_at_size(cache):
+    keys = [predictions._cache_key(np.full(5, i, dtype=np.float32)) for i in range(4)]
+    for key in keys[:3]:
+        predictions._cache_put(key, _result())
+    predictions._cache_get(keys[0])  # now the most recently used
+
+    predictions._cache_put(keys[3], _result())
+    assert len(predictions._PRED_CACHE) == 3
+    assert predictions._cache_get(keys[1]) is None
+    assert all(predictions._cache_get(key) is not None for key in (keys[0], keys[2], keys[3]))
+
+
+def test_predict_flow_uses_cache_for_repeated_flows(cache, store, client, monkeypatch):
+    submitted = []
+
+    async def submit(features):
+        submitted.append(features)
+        return _result("PortScan")
+
+    monkeypatch.setattr(predictions, "batch_scheduler", SimpleNamespace(submit=submit))
+    flow = {
+        "src_ip": "10.0.0.1", "dst_ip": "10.0.0.2", "src_port": 40000, "dst_port": 22,
+        "protocol": "TCP", "flow_duration": 1200,
+    }
+
+    for _ in range(3):
+        response = client.post("/predictions/predict-flow", json=flow)
+        assert response.status_code == 200
+        assert response.json()["attack_type"] == "PortScan"
+    assert len(submitted) == 1
+    # Every request is still recorded, cached or not
+    assert store.get_stats()["total_flows"] == 3
@@ -0,0 +1,57 @@
+"""Tests for the fused preprocessing transform of the ML predictor."""
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from app.ml.predictor import MLPredictor
+from app.ml.preprocessing import FEATURE_COLUMNS
+
+
+def _flow_like_features(n: int) -> np.ndarray:
+    """Random non-negative features spanning flags (0/1) to durations (~1e8)."""
+    rng = np.random.default_rng(0)
+    scales = np.logspace(0, 8, len(FEATURE_COLUMNS))
+    return rng.exponential(1.0, (n, len(FEATURE_COLUMNS))) * scales
+
+
+@pytest.mark.parametrize("scaler_args,pca_args", [
+    ({}, {"n_components": 20}),
+    ({}, {"n_components": 20, "whiten": True}),
+    ({"with_mean": False}, {"n_components": 10}),
+    ({"with_std": False}, {"n_components": 10}),
+])
+def test_affine_transform_matches_scaler_and_pca(scaler_args, pca_args):
+    X_train = _flow_like_features(2000)
+    predictor = MLPredictor()
+    predictor.scaler = StandardScaler(**scaler_args).fit(X_train)
+    predictor.pca = PCA(random_state=0, **pca_args).fit(predictor.scaler.transform(X_train))
+    predictor._build_affine_transform()
+
+    X = _flow_like_features(300)
+    expected = predictor.pca.transform(predictor.scaler.transform(X))
+    actual = X.astype(np.float32) @ predictor._W + predictor._b
+
+    assert predictor._W.dtype == np.float32 and predictor._b.dtype == np.float32
+    assert actual.shape == expected.shape
+    # float32 inference: agree to float32 precision relative to the output's magnitude
+    np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-4 * np.abs(expected).max())
+
+
+_MODEL_DIR = Path(__file__).resolve().parents[2] / "saved_models"
+
+
+@pytest.mark.skipif(not (_MODEL_DIR / "pca.pkl").exists(), reason="saved models not available")
+def test_affine_transform_matches_saved_models():
+    predictor = MLPredictor()
+    predictor.scaler = joblib.load(_MODEL_DIR / "scaler.pkl")
+    predictor.pca = joblib.load(_MODEL_DIR / "pca.pkl")
+    predictor._build_affine_transform()
+
+    X = _flow_like_features(300)
+    expected = predictor.pca.transform(predictor.scaler.transform(X))
+    actual = X.astype(np.float32) @ predictor._W + predictor._b
+    np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-4 * np.abs(expected).max())
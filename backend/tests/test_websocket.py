@@ -0,0 +1,114 @@
+"""Tests for the live WebSocket fan-out and its slow-client policy."""
+import asyncio
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app import main
+
+
+class _StubWebSocket:
+    """Records what the server sends; send_text fails once fail_sends is set."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.fail_sends = False
+
+    async def send_text(self, message: str):
+        if self.fail_sends:
+            raise ConnectionError("client went away")
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+@pytest.fixture(autouse=True)
+def no_clients():
+    main.client_queues.clear()
+    yield
+    main.client_queues.clear()
+
+
+def test_broadcast_queues_messages_for_every_client():
+    async def run():
+        clients = [_StubWebSocket() for _ in range(2)]
+        for ws in clients:
+            main.client_queues[ws] = asyncio.Queue(maxsize=4)
+        await main.broadcast_websocket(["a", "b"])
+        return [[queue.get_nowait() for _ in range(queue.qsize())] for queue in main.client_queues.values()]
+
+    assert asyncio.run(run()) == [["a", "b"], ["a", "b"]]
+
+
+def test_client_with_full_queue_is_dropped_and_closed():
+    async def run():
+        slow, fast = _StubWebSocket(), _StubWebSocket()
+        main.client_queues[slow] = asyncio.Queue(maxsize=1)
+        main.client_queues[fast] = asyncio.Queue(maxsize=4)
+        await main.broadcast_websocket(["a", "b"])
+        await asyncio.sleep(0)  # let the close task run
+        return slow, fast
+
+    slow, fast = asyncio.run(run())
+    assert slow not in main.client_queues
+    assert slow.closed_with == 1013
+    assert fast in main.client_queues
+    assert fast.closed_with is None
+
+
+def test_writer_sends_in_order_until_cancelled():
+    async def run():
+        ws, queue = _StubWebSocket(), asyncio.Queue()
+        writer = asyncio.create_task(main._websocket_writer(ws, queue))
+        for message in ("a", "b", "c"):
+            queue.put_nowait(message)
+        await asyncio.sleep(0.01)
+        writer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await writer
+        return ws
+
+    assert asyncio.run(run()).sent == ["a", "b", "c"]
+
+
+def test_writer_drops_client_when_send_fails():
+    async def run():
+        ws, queue = _StubWebSocket(), asyncio.Queue()
+        ws.fail_sends = True
+        main.client_queues[ws] = queue
+        queue.put_nowait("a")
+        await asyncio.wait_for(main._websocket_writer(ws, queue), timeout=1)
+        return ws
+
+    ws = asyncio.run(run())
+    assert ws not in main.client_queues
+
+
+def test_disconnect_cancels_writer():
+    class _DisconnectingWebSocket(_StubWebSocket):
+        async def accept(self):
+            pass
+
+        async def receive_text(self) -> str:
+            await asyncio.sleep(0.01)
+            raise WebSocketDisconnect(code=1000)
+
+    async def run():
+        ws = _DisconnectingWebSocket()
+        tasks_before = asyncio.all_tasks()
+        endpoint = asyncio.create_task(main.websocket_endpoint(ws))
+        await asyncio.sleep(0)
+        (writer,) = asyncio.all_tasks() - tasks_before - {endpoint}
+        registered = ws in main.client_queues
+
+        await endpoint
+        await asyncio.sleep(0)  # let the cancellation land
+        # Checked before asyncio.run cancels whatever is left
+        return registered, writer.cancelled(), ws
+
+    registered, writer_cancelled, ws = asyncio.run(run())
+    assert registered
+    assert writer_cancelled
+    assert ws not in main.client_queues
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Export the multiclass Random Forest to ONNX for faster batched inference.
+
+Requires: pip install skl2onnx onnxruntime
+"""
+import sys
+import os
+from pathlib import Path
+
+import joblib
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.config import settings
+
+
+def main():
+    model_dir = Path(__file__).parent.parent / settings.MODEL_DIR
+
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        print("✗ skl2onnx not installed. Install with: pip install skl2onnx")
+        return False
+
+    pca = joblib.load(model_dir / "pca.pkl")
+    rf = joblib.load(model_dir / "multiclass_rf_model.pkl")
+
+    # The RF consumes PCA output; zipmap disabled so probabilities come back as a plain tensor
+    onnx_model = convert_sklearn(
+        rf,
+        initial_types=[("X", FloatTensorType([None, int(pca.n_components_)]))],
+        options={id(rf): {"zipmap": False}},
+    )
+
+    output_path = model_dir / "multiclass_rf_model.onnx"
+    with open(output_path, "wb") as f:
+        f.write(onnx_model.SerializeToString())
+
+    print(f"✓ Exported {type(rf).__name__} to {output_path}")
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
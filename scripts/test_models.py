@@ -9,6 +9,36 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
 from app.ml.predictor import predictor
 from app.ml.preprocessing import FEATURE_COLUMNS
 
+def _default_for(col):
+    """Sample value for a feature column, chosen by its name."""
+    if 'Port' in col:
+        return 80
+    elif 'Duration' in col:
+        return 1000000
+    elif 'Packets' in col or 'Bytes' in col or 'Length' in col:
+        return 10
+    elif 'Mean' in col or 'Std' in col or 'Variance' in col:
+        return 0.0
+    elif 'Flags' in col or 'Count' in col:
+        return 0
+    elif 'Ratio' in col or 'Size' in col:
+        return 1.0
+    elif 's' in col and '/' in col:  # Rate features like "Flow Bytes/s"
+        return 1000.0
+    elif 'IAT' in col:
+        return 1000.0 if 'Mean' in col or 'Std' in col else 1000
+    elif 'Header' in col:
+        return 20
+    elif 'Win' in col or 'seg' in col.lower():
+        return 65535 if 'Win' in col else 1500
+    elif 'Active' in col or 'Idle' in col:
+        return 1000.0 if 'Mean' in col or 'Std' in col else 1000
+    else:
+        return 0
+
+# Sample flow with all required features, built once
+_DEFAULTS = {col: _default_for(col) for col in FEATURE_COLUMNS}
+
 def test_model_loading():
     """Test that models can be loaded."""
     print("Testing model loading...")
@@ -24,34 +54,7 @@ def test_prediction():
     """Test making a sample prediction."""
     print("\nTesting prediction...")
     
-    # Create a sample flow dictionary with all required features
-    sample_flow = {}
-    for col in FEATURE_COLUMNS:
-        # Set some default values
-        if 'Port' in col:
-            sample_flow[col] = 80
-        elif 'Duration' in col:
-            sample_flow[col] = 1000000
-        elif 'Packets' in col or 'Bytes' in col or 'Length' in col:
-            sample_flow[col] = 10
-        elif 'Mean' in col or 'Std' in col or 'Variance' in col:
-            sample_flow[col] = 0.0
-        elif 'Flags' in col or 'Count' in col:
-            sample_flow[col] = 0
-        elif 'Ratio' in col or 'Size' in col:
-            sample_flow[col] = 1.0
-        elif 's' in col and '/' in col:  # Rate features like "Flow Bytes/s"
-            sample_flow[col] = 1000.0
-        elif 'IAT' in col:
-            sample_flow[col] = 1000.0 if 'Mean' in col or 'Std' in col else 1000
-        elif 'Header' in col:
-            sample_flow[col] = 20
-        elif 'Win' in col or 'seg' in col.lower():
-            sample_flow[col] = 65535 if 'Win' in col else 1500
-        elif 'Active' in col or 'Idle' in col:
-            sample_flow[col] = 1000.0 if 'Mean' in col or 'Std' in col else 1000
-        else:
-            sample_flow[col] = 0
+    sample_flow = _DEFAULTS.copy()
     
     try:
         result = predictor.predict(sample_flow)